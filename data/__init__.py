@@ -1,7 +1,12 @@
 import importlib
+import inspect
+import time
 import torch.utils.data
 from data.base_data_loader import BaseDataLoader
 from data.base_dataset import BaseDataset
+from data.batch_augmentation import BatchAugmentation, SameSizeCollate
+from data.prefetcher import prefetch
+from data.distributed import shard_sampler
 
 
 def find_dataset_using_name(dataset_name):
@@ -48,7 +53,7 @@ def CreateDataLoader(opt):
 
 def SplitDataLoader(dataloader, opt0, opt1, length_first):
     loader_0,loader_1 = CustomDatasetDataLoader(), CustomDatasetDataLoader()
-    set_0,set_1 = torch.utils.data.random_split(dataloader.dataset,[length_first, len(dataloader) - length_first])
+    set_0,set_1 = torch.utils.data.random_split(dataloader.dataset,[length_first, len(dataloader.dataset) - length_first])
     loader_0.initialize(opt0, dataset = set_0)
     loader_1.initialize(opt1, dataset = set_1)
     return loader_0, loader_1
@@ -62,21 +67,96 @@ class CustomDatasetDataLoader(BaseDataLoader):
     def initialize(self, opt, dataset = None):
         BaseDataLoader.initialize(self, opt)
         self.dataset = dataset if dataset else create_dataset(opt)
-
+        use_gpu = isinstance(opt.gpu_ids, list) and len(opt.gpu_ids) > 0
+        self.device = torch.device(f"cuda:{opt.gpu_ids[0]}") if use_gpu else torch.device("cpu")
+
+        loader_args = {}
+        if opt.prefetch and int(opt.num_threads) > 0: 
+            # keep workers alive across epochs (only available in newer torch versions)
+            params = inspect.signature(torch.utils.data.DataLoader.__init__).parameters
+            if "persistent_workers" in params: 
+                loader_args["persistent_workers"] = True
+            if "prefetch_factor" in params: 
+                loader_args["prefetch_factor"] = opt.prefetch_factor
+
+        # split loaders get a Subset, sampler hooks only apply to the full dataset
+        base_dataset = self.dataset.dataset if isinstance(self.dataset, torch.utils.data.Subset) else self.dataset
+        self.clips_per_item = base_dataset.clips_per_item
+        sampler = self.dataset.get_sampler() if isinstance(self.dataset, BaseDataset) else None
+        batch_size = max(1, opt.batch_size // base_dataset.clips_per_item)
+        shuffle = not opt.serial_batches and sampler is None
+        batch_sampler = None
+        if opt.length_buckets and opt.phase == "train": 
+            # (index, nframes) batches index the full dataset, a split only contributes its own indices
+            indices = self.dataset.indices if isinstance(self.dataset, torch.utils.data.Subset) else None
+            batch_sampler = base_dataset.get_batch_sampler(batch_size, not opt.serial_batches, indices)
+        if opt.world_size > 1: 
+            if batch_sampler is not None: 
+                batch_sampler = shard_sampler(base_dataset, batch_sampler, opt.world_size, opt.rank, shuffle = not opt.serial_batches)
+            else: 
+                sampler = shard_sampler(self.dataset, sampler, opt.world_size, opt.rank, shuffle = not opt.serial_batches)
+                shuffle = False
+        self.epoch = 0
+
+        if batch_sampler is not None: 
+            loader_args["batch_sampler"] = batch_sampler
+        else: 
+            loader_args.update(batch_size=batch_size, shuffle=shuffle, sampler=sampler)
+
+        collate_fn = base_dataset.get_collate_fn()
+        if opt.batch_augmentation: 
+            collate_fn = SameSizeCollate(collate_fn)
+
+        # pinned batches allow set_input to copy them asynchronously
         self.dataloader = torch.utils.data.DataLoader(
-            self.dataset,
-            batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+            base_dataset if batch_sampler is not None else self.dataset,
+            collate_fn=collate_fn,
+            num_workers=int(opt.num_threads),
+            pin_memory=use_gpu,
+            **loader_args)
+
+        self.augmentation = None
+        if opt.batch_augmentation: 
+            # datasets skip resizing, so loaders that don't augment still resize on the device
+            if opt.phase == "train" and not opt.no_augmentation: 
+                self.augmentation = BatchAugmentation(opt.resolution, crop_scale = opt.aug_crop_scale, jitter = opt.aug_jitter)
+            else: 
+                self.augmentation = BatchAugmentation(opt.resolution, flip = False)
+        self.data_time = 0 # seconds the consumer waited for batches during the last pass
 
     def load_data(self):
         return self
 
     def __len__(self):
-        return min(len(self.dataset), self.opt.max_dataset_size)
+        # samples seen by this rank (an item can hold several clips), max_dataset_size is shared by all ranks
+        return min(len(self.dataset) * self.clips_per_item, self.opt.max_dataset_size) // self.opt.world_size
+
+    def batches(self):
+        sampler = self.dataloader.batch_sampler if self.dataloader.batch_size is None else self.dataloader.sampler
+        if hasattr(sampler, "set_epoch"): 
+            sampler.set_epoch(self.epoch)
+        self.epoch += 1
+        n = 0 # samples so far, bucketed batches vary in size
+        for data in self.dataloader:
+            if n * self.opt.world_size >= self.opt.max_dataset_size:
+                break
+            n += data['VIDEO'].size(0)
+            yield data
 
     def __iter__(self):
-        for i, data in enumerate(self.dataloader):
-            if i * self.opt.batch_size >= self.opt.max_dataset_size:
-                break
+        batches = self.batches()
+        if self.opt.prefetch: 
+            # next batch is staged on the device (cuda stream) or in a background thread (cpu) while the current one is used
+            batches = prefetch(batches, self.device, self.opt.prefetch_factor)
+        self.data_time = 0
+        t = time.time()
+        for data in batches:
+            if self.augmentation: 
+                with torch.no_grad(): 
+                    seg = data['SEGMENTATION'].to(self.device, non_blocking=True) if 'SEGMENTATION' in data else None
+                    data['VIDEO'], seg = self.augmentation(data['VIDEO'].to(self.device, non_blocking=True), seg)
+                    if seg is not None: 
+                        data['SEGMENTATION'] = seg
+            self.data_time += time.time() - t
             yield data
+            t = time.time()
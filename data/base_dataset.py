@@ -1,3 +1,7 @@
+import re
+import random
+import torch
+import torch.nn.functional as F
 import torch.utils.data as data
 from PIL import Image
 import torchvision.transforms as transforms
@@ -20,6 +24,134 @@ class BaseDataset(data.Dataset):
     def __len__(self):
         return 0
 
+    # loader hooks: a custom sampler/collate function (None: shuffled batches, default collation) and
+    # the number of clips every item contributes to a batch
+    clips_per_item = 1
+
+    def get_sampler(self):
+        return None
+
+    def get_collate_fn(self):
+        return None
+
+    # batches of (index, nframes) for datasets with variable clip lengths (--length_buckets), indices: a split's
+    # indices into this dataset (None: all)
+    def get_batch_sampler(self, batch_size, shuffle, indices = None):
+        return None
+
+    # per sample random flip + resize of video datasets, skipped with --batch_augmentation (done per batch on the
+    # training device, data/batch_augmentation.py)
+    def init_clip_preprocessing(self, opt):
+        self.batch_augmentation = opt.batch_augmentation
+        self.flip = opt.phase == "train" and not opt.no_augmentation and not self.batch_augmentation
+
+    # uint8 clip (see preprocess_clip) and whether it was flipped, masks of the sample have to follow
+    def preprocess_video(self, frames, nframes):
+        flip = self.flip and random.random() < 0.5
+        return preprocess_clip(frames, nframes, None if self.batch_augmentation else self.resolution, flip = flip), flip
+
+
+# collate for items that already hold several clips (K x T x H x W x C): one batch of all clips
+def cat_collate(batch):
+    return {k: torch.cat([b[k] for b in batch]) for k in batch[0]}
+
+
+class EpochSampler(torch.utils.data.Sampler):
+    # items (epoch + 1) * n + i of a seeded stream, so every training epoch renders new batches. indices < n
+    # (validation / test, see BatchRenderedDataset) are never drawn
+    def __init__(self, n):
+        self.n = n
+        self.epoch = 0
+
+    def __iter__(self):
+        return iter(range((self.epoch + 1) * self.n, (self.epoch + 2) * self.n))
+
+    def __len__(self):
+        return self.n
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+class BatchRenderedDataset(BaseDataset):
+    """
+    Datasets that render a whole batch per item (vectorized over the batch): the loader fetches one item per batch
+    and cat_collate flattens it. len counts items, the loader's len counts samples (items * clips_per_item).
+    Subclasses call init_batches in initialize and implement render(B, generator).
+    With a seed the stream is reproducible: training draws new items every epoch (EpochSampler), other phases and
+    validation splits always render the same first len items.
+    """
+    def init_batches(self, opt, epoch_size, seed):
+        self.seed = seed
+        self.clips_per_item = opt.batch_size
+        self.len = max(1, int(min(opt.max_dataset_size, epoch_size)) // self.clips_per_item)
+        self.fixed = opt.phase != "train"
+
+    def get_sampler(self):
+        if self.seed < 0 or self.fixed:
+            return None
+        return EpochSampler(self.len)
+
+    def __len__(self):
+        return self.len
+
+    def get_collate_fn(self):
+        return cat_collate
+
+    # hook of the subclasses: one item of B clips, {'VIDEO': B x T x H x W x C uint8, ...}. generator is the seeded
+    # torch.Generator of the item (None: unseeded)
+    def render(self, B, generator = None):
+        pass
+
+    def __getitem__(self, index):
+        # seed >= 0: every index always renders the same batch, otherwise every call is new
+        generator = None
+        if self.seed >= 0:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed * 1000003 + index)
+        return self.render(self.clips_per_item, generator)
+
+
+# indices of the frames that survive --skip_frames, computed up front so readers only decode/load those.
+# clips that are too short repeat their last frame
+def select_frames(num_frames, nframes, skip_frames = 1, start = 0):
+    indices = start + torch.arange(nframes) * skip_frames
+    return indices.clamp_(0, max(num_frames - 1, 0))
+
+
+# clips travel as uint8 (workers -> collate -> pinned host -> device), models convert to float on the device
+def to_uint8(frames):
+    if frames.dtype == torch.uint8:
+        return frames
+    return frames.round().clamp_(0, 255).to(torch.uint8)
+
+
+def preprocess_clip(frames, nframes, resolution = None, flip = False):
+    """
+    First nframes of a T x H x W x C clip, resized to resolution x resolution (None: keep the size) and flipped
+    horizontally, as uint8 T x res x res x C. Cropping and permuting are views of the input, the result is written
+    once into the output, without a resize that is the only allocation (the resize adds its float input and result).
+    """
+    frames = frames[:nframes]
+    T, H, W, C = frames.shape
+    size = (H, W) if resolution is None else (resolution, resolution)
+    out = torch.empty((T,) + size + (C,), dtype = torch.uint8)
+    if size != (H, W): 
+        x = F.interpolate(frames.permute(0,3,1,2).float(), size = size, mode = "bilinear", align_corners=False)
+        frames = x.round_().clamp_(0, 255).permute(0,2,3,1)
+    elif frames.dtype != torch.uint8: 
+        frames = frames.round().clamp_(0, 255)
+    if flip and frames.dtype == out.dtype: 
+        torch.index_select(frames, 2, torch.arange(size[1] - 1, -1, -1), out = out)
+    else: 
+        out.copy_(frames.flip(2) if flip else frames)
+    return out
+
+
+# sorts frame files by the numbers in their names (frame_2.png < frame_10.png)
+def frame_sort_key(path):
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', path)]
+
 
 def get_transform(opt):
     transform_list = []
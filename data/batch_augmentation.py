@@ -0,0 +1,78 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.data.dataloader import default_collate
+
+
+class SameSizeCollate():
+    """
+    Collate for --batch_augmentation: datasets don't resize anymore, so all clips of a batch need the same
+    source resolution. Fails with a readable error instead of a size mismatch inside the collate.
+    """
+    def __init__(self, collate = None):
+        self.collate = collate or default_collate
+
+    def __call__(self, batch):
+        sizes = sorted({tuple(b['VIDEO'].shape[-3:-1]) for b in batch})
+        if len(sizes) > 1:
+            raise RuntimeError(f"--batch_augmentation: clips of one batch have different source resolutions {sizes}, "
+                               "convert the videos to one resolution or train without --batch_augmentation")
+        return self.collate(batch)
+
+
+class BatchAugmentation():
+    """
+    Train time augmentation of collated B x T x H x W x C clips (0-255) on the training device.
+    Parameters are drawn per sample and shared by all frames of a clip. Random crop, horizontal flip and
+    the resize to --resolution are folded into one affine grid_sample; colour jitter works on brightness,
+    contrast and saturation. Masks (B x 1 x H x W) get the same geometry.
+    """
+    def __init__(self, resolution, flip = True, crop_scale = 1.0, jitter = 0.0):
+        self.resolution = resolution
+        self.flip = flip
+        self.crop_scale = crop_scale
+        self.jitter = jitter
+
+    def geometry(self, x, flip, scale = None, center = None, mode = "bilinear"):
+        # x: B x T x C x H x W, scale (B) / center (B x 2) of the crop when crop_scale < 1
+        B, T, C, H, W = x.shape
+        res = self.resolution
+        if self.crop_scale >= 1:
+            if H != res or W != res:
+                x = F.interpolate(x.reshape(B*T, C, H, W), size = (res, res), mode = mode, align_corners=False if mode == "bilinear" else None).view(B, T, C, res, res)
+            return torch.where(flip.view(B,1,1,1,1), x.flip(-1), x) if self.flip else x
+        theta = torch.zeros(B, 2, 3, device = x.device)
+        theta[:,0,0] = torch.where(flip, -scale, scale)
+        theta[:,1,1] = scale
+        theta[:,:,2] = center
+        grid = F.affine_grid(theta, (B, C, res, res), align_corners=False)
+        grid = grid.unsqueeze(1).expand(-1, T, -1, -1, -1).reshape(B*T, res, res, 2)
+        x = F.grid_sample(x.reshape(B*T, C, H, W), grid, mode = mode, padding_mode = "border", align_corners=False)
+        return x.view(B, T, C, res, res)
+
+    def color(self, x):
+        B = x.size(0)
+        def factor():
+            return (1 + (torch.rand(B, device = x.device) * 2 - 1) * self.jitter).view(B,1,1,1,1)
+        x = x * factor()
+        mean = x.mean(dim = (1,2,3,4), keepdim = True)
+        x = (x - mean) * factor() + mean
+        gray = (x[:,:,0:1] * 0.299 + x[:,:,1:2] * 0.587 + x[:,:,2:3] * 0.114)
+        x = (x - gray) * factor() + gray
+        return x.clamp_(0, 255)
+
+    def __call__(self, video, mask = None):
+        B = video.size(0)
+        x = video.permute(0,1,4,2,3).float() # B x T x C x H x W
+        flip = torch.rand(B, device = x.device) < 0.5
+        if not self.flip:
+            flip.zero_()
+        scale, center = None, None
+        if self.crop_scale < 1:
+            scale = torch.empty(B, device = x.device).uniform_(self.crop_scale, 1)
+            center = (torch.rand(B, 2, device = x.device) * 2 - 1) * (1 - scale).unsqueeze(1)
+        x = self.geometry(x, flip, scale, center)
+        if self.jitter > 0 and x.size(2) == 3:
+            x = self.color(x)
+        if mask is not None:
+            mask = self.geometry(mask.unsqueeze(1).float(), flip, scale, center, mode = "nearest").squeeze(1).round().to(mask.dtype)
+        return x.permute(0,1,3,4,2), mask
@@ -0,0 +1,55 @@
+import math
+import torch
+
+
+# longest bucket a clip fills, None for clips shorter than every bucket (they would need padding)
+def bucket_of(length, buckets):
+    fits = [b for b in buckets if b <= length]
+    return max(fits) if len(fits) > 0 else None
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batches of (index, nframes) pairs in which every clip has the same length bucket, so no batch carries padding.
+    Batch sizes are frame_budget // nframes: every batch costs about the same memory, short clips come in large
+    batches and long clips are not cropped. The order is drawn from seed + epoch, so every rank
+    (data/distributed.py) sees the same batches.
+    """
+    def __init__(self, indices, lengths, buckets, frame_budget, shuffle = True, seed = 0):
+        self.buckets = {}
+        too_short = 0
+        for i, length in zip(indices, lengths):
+            bucket = bucket_of(length, buckets)
+            if bucket is None:
+                too_short += 1
+                continue
+            self.buckets.setdefault(bucket, []).append(i)
+        if too_short > 0:
+            print(f"length buckets: skipping {too_short}/{len(indices)} clips shorter than {min(buckets)} frames")
+        self.batch_sizes = {b: max(1, frame_budget // b) for b in self.buckets}
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        print("length buckets (frames: clips): " + ", ".join(f"{b}: {len(idx)}" for b, idx in sorted(self.buckets.items())))
+
+    def batches(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        batches = []
+        for b, idx in sorted(self.buckets.items()):
+            if self.shuffle:
+                idx = [idx[i] for i in torch.randperm(len(idx), generator = generator).tolist()]
+            n = self.batch_sizes[b]
+            batches += [[(i, b) for i in idx[j:j + n]] for j in range(0, len(idx), n)]
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator = generator).tolist()]
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return sum(math.ceil(len(idx) / self.batch_sizes[b]) for b, idx in self.buckets.items())
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
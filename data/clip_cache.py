@@ -0,0 +1,102 @@
+import os
+import shutil
+import json
+import random
+import hashlib
+import torch
+import torchvision
+import torch.nn.functional as F
+
+from data.shards import ShardReader, ShardWriter
+from data.distributed import tmp_path
+
+
+CACHE_VERSION = 2
+
+# everything that changes the decoded frames has to end up in the key, otherwise stale shards would be reused
+def cache_key(clips_file, n_clips, resolution, skip_frames, rows = None):
+    stat = os.stat(clips_file)
+    params = {
+        "version": CACHE_VERSION,
+        "clips_file": os.path.abspath(clips_file),
+        "clips_mtime": stat.st_mtime,
+        "clips_size": stat.st_size,
+        "n_clips": n_clips,
+        "resolution": resolution,
+        "skip_frames": skip_frames,
+    }
+    if rows is not None: # clips file rows left after dropping undecodable clips (--probe_clips)
+        params["rows"] = hashlib.sha1(json.dumps(rows).encode("utf-8")).hexdigest()
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def resize_frames(frames, resolution, chunk = 64):
+    # T x H x W x C uint8 -> T x res x res x C uint8, chunked so long clips dont blow up as float
+    T, H, W, C = frames.shape
+    if H == resolution and W == resolution:
+        return frames
+    out = torch.empty((T, resolution, resolution, C), dtype = torch.uint8)
+    for i in range(0, T, chunk):
+        x = frames[i:i+chunk].permute(0,3,1,2).float()
+        x = F.interpolate(x, size = (resolution, resolution), mode = "bilinear", align_corners=False)
+        out[i:i+chunk] = x.permute(0,2,3,1).round_().clamp_(0,255).to(torch.uint8)
+    return out
+
+def decode_clip(file_name, start, end, resolution, skip_frames):
+    frames, _, _ = torchvision.io.read_video(file_name, start, end, pts_unit="sec")
+    if frames.shape[0] == 0:
+        return torch.zeros((0, resolution, resolution, 3), dtype = torch.uint8)
+    # every skip_frames-th source frame like read_clip, no resampling to fps (the uncached clips aren't resampled either)
+    return resize_frames(frames[::skip_frames], resolution)
+
+
+class ClipCache():
+    """
+    Decodes every clip of a clips file once at the target resolution/skip_frames and stores
+    the frames as uint8 (T x H x W x C) in memory mapped .npy shards. Samples are served as
+    zero-copy views into the shards.
+    Layout: <cache_dir>/<key>/shard_XXXXX.npy + index.npy (clip -> shard, offset, length)
+    """
+    def __init__(self, cache_dir, root, df, clips_file, resolution, skip_frames, shard_frames = 20000, rows = None):
+        self.resolution = resolution
+        self.key = cache_key(clips_file, len(df), resolution, skip_frames, rows = rows)
+        self.dir = os.path.join(cache_dir, self.key)
+        self.index_file = os.path.join(self.dir, "index.npy")
+        if not os.path.exists(self.index_file):
+            self.build(root, df, skip_frames, shard_frames)
+        self.shards = ShardReader(self.dir)
+
+    def build(self, root, df, skip_frames, shard_frames):
+        # every process (rank) builds into its own directory, the first complete one is moved into place
+        print(f"building clip cache: {self.dir}")
+        tmp_dir = tmp_path(self.dir)
+        writer = ShardWriter(tmp_dir, self.resolution, shard_frames)
+        for i in range(len(df)):
+            clip = df.iloc[i]
+            writer.add(decode_clip(os.path.join(root, clip['file_name']), clip['start'], clip['end'], self.resolution, skip_frames))
+            if i % 100 == 0:
+                print(f"clip cache: {i+1}/{len(df)}")
+        writer.close()
+        if os.path.isdir(self.dir) and not os.path.exists(self.index_file):
+            shutil.rmtree(self.dir, ignore_errors=True) # left over from an interrupted build
+        try:
+            os.replace(tmp_dir, self.dir)
+        except OSError: # built by another rank in the meantime
+            shutil.rmtree(tmp_dir)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def num_frames(self, index):
+        return self.shards.num_frames(index)
+
+    def get(self, index, start = 0, length = None):
+        frames = self.shards.frames(index)
+        n = frames.shape[0]
+        length = n - start if length is None else min(length, n - start)
+        return torch.from_numpy(frames[start: start + length])
+
+    def sample(self, index, nframes):
+        # random window of nframes, the caller handles clips that are too short
+        n = self.num_frames(index)
+        start = random.randint(0, n - nframes) if n > nframes else 0
+        return self.get(index, start, nframes)
@@ -0,0 +1,65 @@
+import os
+import json
+import numpy as np
+import torch
+
+from data.clip_cache import resize_frames
+from data.shards import ShardReader, ShardWriter
+from data.distributed import tmp_path
+
+
+def resize_multiple(frames, sizes):
+    # T x H x W x C uint8 at source resolution -> one uint8 array per size
+    return [resize_frames(frames, size).numpy() for size in sizes]
+
+
+def build_pyramid(out_dir, keys, frame_iter, sizes = (64, 128, 256), shard_frames = 20000):
+    """
+    Stores every clip at several resolutions, like stylegan2/prepare_data.py does for images.
+    frame_iter yields, in the order of keys, lists with one T x size x size x C uint8 array per size (see resize_multiple).
+    Layout: <out_dir>/<size>/shard_XXXXX.npy + index.npy, pyramid.json (sizes + clip keys) is written last.
+    """
+    writers = [ShardWriter(os.path.join(out_dir, str(size)), size, shard_frames) for size in sizes]
+    for i, levels in enumerate(frame_iter):
+        for writer, frames in zip(writers, levels):
+            writer.add(frames)
+        if i % 100 == 0:
+            print(f"clip pyramid: {i+1}/{len(keys)}")
+    for writer in writers:
+        writer.close()
+    meta_file = os.path.join(out_dir, "pyramid.json")
+    with open(tmp_path(meta_file), "w") as f:
+        json.dump({"sizes": list(sizes), "keys": keys}, f)
+    os.replace(tmp_path(meta_file), meta_file)
+
+
+class ClipPyramid():
+    """
+    Reads clips from the level of a pyramid built by misc/build_clip_pyramid.py that is closest to resolution
+    (the smallest level >= resolution, otherwise the largest one). Frames are stored at source fps, so
+    callers pick the frames of their window (select_frames) and only those are copied out of the mapped shards.
+    Clips are looked up by key, so a dataset that dropped clips (--probe_clips) can use a pyramid of the full list.
+    """
+    def __init__(self, dir, resolution, keys):
+        with open(os.path.join(dir, "pyramid.json")) as f:
+            meta = json.load(f)
+        stored = {k: i for i, k in enumerate(meta["keys"])}
+        missing = [k for k in keys if k not in stored]
+        if len(missing) > 0:
+            raise RuntimeError(f"clip pyramid {dir} has no frames for {len(missing)}/{len(keys)} clips (eg. {missing[0]}), rebuild it with misc/build_clip_pyramid.py")
+        self.rows = np.array([stored[k] for k in keys], dtype = np.int64) # dataset index -> stored clip
+        sizes = sorted(meta["sizes"])
+        larger = [s for s in sizes if s >= resolution]
+        self.size = larger[0] if len(larger) > 0 else sizes[-1]
+        self.shards = ShardReader(os.path.join(dir, str(self.size)))
+        print(f"clip pyramid: using {self.size}x{self.size} level for resolution {resolution}")
+
+    def num_frames(self, index):
+        return self.shards.num_frames(self.rows[index])
+
+    def get(self, index, indices):
+        # T x size x size x C uint8, only the selected frames are read
+        frames = self.shards.frames(self.rows[index])
+        if frames.shape[0] == 0:
+            return torch.zeros((len(indices), self.size, self.size, 3), dtype = torch.uint8)
+        return torch.from_numpy(frames[np.asarray(indices)])
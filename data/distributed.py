@@ -0,0 +1,60 @@
+import os
+import itertools
+import torch
+from torch.utils.data.distributed import DistributedSampler
+
+
+# temporary file next to path for an atomic os.replace, unique per process: ranks (and loader workers) that build the
+# same cache concurrently never write into each other's partial files, the last complete one wins
+def tmp_path(path):
+    return f"{path}.{os.getpid()}.tmp{os.path.splitext(path)[1]}"
+
+
+class WeightedEpochSampler(torch.utils.data.Sampler):
+    # WeightedRandomSampler (with replacement) drawn from seed + epoch, so every rank draws the same sequence
+    def __init__(self, weights, num_samples, seed = 0):
+        self.weights = torch.as_tensor(weights, dtype = torch.double)
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        return iter(torch.multinomial(self.weights, self.num_samples, replacement = True, generator = generator).tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+class ShardedSampler(torch.utils.data.Sampler):
+    # every num_replicas-th index of a dataset specific sampler (eg. video balanced), which has to draw the same
+    # sequence on every rank (seeded per epoch via set_epoch, see WeightedEpochSampler)
+    def __init__(self, sampler, num_replicas, rank):
+        self.sampler = sampler
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def __iter__(self):
+        return itertools.islice(iter(self.sampler), self.rank, None, self.num_replicas)
+
+    def __len__(self):
+        return (len(self.sampler) - self.rank + self.num_replicas - 1) // self.num_replicas
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+
+def shard_sampler(dataset, sampler, num_replicas, rank, shuffle):
+    """
+    Sampler that only yields this rank's share of the dataset, so every process decodes its own samples.
+    Without a dataset specific sampler the shards are disjoint and shuffled with the same seed on every rank,
+    the loader calls set_epoch before every pass to get a new (deterministic) order per epoch.
+    """
+    if sampler is not None:
+        return ShardedSampler(sampler, num_replicas, rank)
+    return DistributedSampler(dataset, num_replicas = num_replicas, rank = rank, shuffle = shuffle)
@@ -4,7 +4,7 @@ import numpy as np
 import sys
 import os
 import random
-from data.base_dataset import BaseDataset
+from data.base_dataset import BaseDataset, to_uint8
 
 class DummyDataset(BaseDataset): 
 
@@ -55,6 +55,6 @@ class DummyDataset(BaseDataset):
             x = int(self.start_pos + int(t*d) - s2)
             frames[t:t+1,y:y+self.size, x:x+self.size,:] = box
 
-        return {'VIDEO':frames}
+        return {'VIDEO':to_uint8(frames)}
 
 
@@ -3,15 +3,36 @@ import numpy as np
 from torch._C import dtype
 import torchvision
 import os
-from data.base_dataset import BaseDataset
+import hashlib
+from functools import lru_cache
+from data.base_dataset import BaseDataset, to_uint8
 import torch.nn.functional as F
 import torchvision.transforms as transforms
 import glob
 from PIL import Image
+from data.distributed import tmp_path
 
 
+@lru_cache(maxsize=None)
+def read_labels(file): 
+    with open(file) as f: 
+        return {int(x.split(':')[0]): x.split(':')[1] for x in f.read().split('\n')}
+
+# 0/1 table over the raw red channel values of the label images (class index - 1) -> one indexing op per image
+@lru_cache(maxsize=None)
+def dynamic_lookup_table(file): 
+    lut = np.zeros(256, dtype = np.uint8)
+    for i in read_labels(file).keys(): 
+        if 1 <= i <= 256: 
+            lut[i - 1] = 1
+    return lut
+
 class ImageDataset(BaseDataset): 
 
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--seg_cache_dir', type=str, default=None, help='cache the resized binary segmentation masks (keyed by label image path) in this directory')
+        return parser
 
     def initialize(self, opt):
         self.root = opt.dataroot
@@ -35,34 +56,44 @@ class ImageDataset(BaseDataset):
         self.len = int(min(opt.max_dataset_size, len(self.images)))
 
         if self.use_segmentation: 
-            with open("./data/cocostuff_labels_dynamic.txt") as f: 
-                #self.dynamic_indices = torch.tensor([int(x.split(':')[0]) for x in f.read().split('\n')])
-                self.dynamic_dict = {int(x.split(':')[0]): x.split(':')[1] for x in f.read().split('\n')}
-                self.dynamic_indices = self.dynamic_dict.keys()
-              
-            with open("./data/cocostuff_labels.txt") as f: 
-                self.label_dict = {int(x.split(':')[0]): x.split(':')[1] for x in f.read().split('\n')}
+            self.dynamic_dict = read_labels("./data/cocostuff_labels_dynamic.txt")
+            self.dynamic_indices = self.dynamic_dict.keys()
+            self.label_dict = read_labels("./data/cocostuff_labels.txt")
+            self.dynamic_lut = dynamic_lookup_table("./data/cocostuff_labels_dynamic.txt")
+        self.seg_cache_dir = opt.seg_cache_dir
+        if self.seg_cache_dir: 
+            os.makedirs(self.seg_cache_dir, exist_ok=True)
 
 
     def __len__(self): 
         return self.len
 
+    def mask_cache_file(self, seg_file): 
+        # keyed by the absolute path (+ mtime) of the label image and the resolution
+        seg_file = os.path.abspath(seg_file)
+        key = f"{seg_file}:{os.path.getmtime(seg_file)}:{self.resolution}"
+        return os.path.join(self.seg_cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
     def __getitem__(self, index):
         image = transforms.ToTensor()(Image.open(self.images[index]))
 
         image = F.interpolate(image.unsqueeze(0), size = (self.resolution, self.resolution), mode = "bilinear", align_corners=False).squeeze(0) *255
         image = image.permute(1,2,0) #w,h,c
-        out = {'VIDEO': image.unsqueeze(0)}
+        out = {'VIDEO': to_uint8(image.unsqueeze(0))}
 
         if self.use_segmentation: 
-            labelmap = np.array(Image.open(self.seg[index]), dtype = np.long)[:,:,0] +1 #indices are in red channel, shifted by 1 
-            staticmap = np.zeros_like(labelmap)
-            for i in self.dynamic_indices: 
-                staticmap[labelmap==i] = 1
-            bseg = torch.tensor(staticmap).unsqueeze(0)
-            bseg = F.interpolate(bseg.unsqueeze(0).float(), size = (self.resolution, self.resolution), mode = "bilinear", align_corners=False).squeeze(0).round()
+            cache_file = self.mask_cache_file(self.seg[index]) if self.seg_cache_dir else None
+            if cache_file and os.path.exists(cache_file): 
+                bseg = torch.from_numpy(np.load(cache_file)).unsqueeze(0).float()
+            else: 
+                labelmap = np.array(Image.open(self.seg[index]))[:,:,0] #indices are in red channel, shifted by 1 (see dynamic_lookup_table)
+                bseg = torch.from_numpy(self.dynamic_lut[labelmap]).unsqueeze(0)
+                bseg = F.interpolate(bseg.unsqueeze(0).float(), size = (self.resolution, self.resolution), mode = "bilinear", align_corners=False).squeeze(0).round()
+                if cache_file: 
+                    np.save(tmp_path(cache_file), bseg[0].to(torch.uint8).numpy())
+                    os.replace(tmp_path(cache_file), cache_file)
             out['SEGMENTATION'] = bseg
-            # print(f"{self.images[index]}-{self.seg[index]} found: {[(x, self.label_dict.get(x)) for x in np.unique(labelmap).tolist()]}")
+            # print(f"{self.images[index]}-{self.seg[index]} found: {[(x, self.label_dict.get(x)) for x in (np.unique(labelmap) + 1).tolist()]}")
             # print(out['SEGMENTATION'].shape)
         return out
 
@@ -0,0 +1,38 @@
+import os
+import json
+from data.distributed import tmp_path
+
+
+def manifest_file(root, name):
+    return os.path.join(root, "." + name + "_manifest.json")
+
+def _mtimes(root, dirs):
+    return {d: os.stat(os.path.join(root, d)).st_mtime for d in dirs}
+
+def _is_valid(root, manifest):
+    try:
+        return all(os.stat(os.path.join(root, d)).st_mtime == m for d, m in manifest["dirs"].items())
+    except OSError: # a directory was removed
+        return False
+
+def load_manifest(root, name, scan, rescan = False):
+    """
+    Returns scan(root) from the manifest written on the first scan. scan returns (data, dirs) where dirs are the
+    directories (relative to root) whose listings went into data, adding or removing files changes their mtime and
+    invalidates the manifest. Checking it costs one stat per directory instead of listing every file.
+    """
+    path = manifest_file(root, name)
+    if not rescan and os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if _is_valid(root, manifest):
+            return manifest["data"]
+        print(f"manifest {path} is outdated, rescanning")
+    data, dirs = scan(root)
+    try:
+        with open(tmp_path(path), "w") as f:
+            json.dump({"dirs": _mtimes(root, dirs), "data": data}, f)
+        os.replace(tmp_path(path), path)
+    except OSError as e: # read only dataset, scan every time
+        print(f"could not write manifest {path}: {e}")
+    return data
@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+
+from data.shards import WorkerLocal
+from data.distributed import tmp_path
+
+
+# everything that changes which frames a sample covers or how its mask is computed goes into the file name
+def mask_store_file(opt):
+    params = {
+        "dataset_mode": opt.dataset_mode,
+        "phase": opt.phase,
+        "clips_file": opt.clips_file,
+        "eps": opt.motion_seg_eps,
+        "resolution": opt.resolution,
+        "fps": opt.fps,
+        "max_clip_length": opt.max_clip_length,
+        "skip_frames": opt.skip_frames,
+        "clip_windows": getattr(opt, "clip_windows", False),
+        "probe_clips": opt.probe_clips,
+    }
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(opt.dataroot, f".motion_masks_{key}.npy")
+
+def pack_masks(masks):
+    # B x 1 x H x W (0/1) -> B x ceil(H*W/8) uint8
+    masks = masks.reshape(masks.size(0), -1).numpy().astype(np.uint8)
+    return np.packbits(masks, axis = 1)
+
+def write_masks(file, packed):
+    with open(tmp_path(file), "wb") as f:
+        np.save(f, packed)
+    os.replace(tmp_path(file), file)
+
+
+class MaskStore(WorkerLocal):
+    """
+    Bit packed motion segmentation masks, one row per dataset index, written by misc/precompute_masks.py.
+    """
+    worker_local = {"masks": None}
+
+    def __init__(self, opt, length):
+        self.file = mask_store_file(opt)
+        if not os.path.exists(self.file):
+            raise RuntimeError(f"no precomputed masks for these options ({self.file}), run misc/precompute_masks.py with the same arguments first")
+        self.resolution = opt.resolution
+        self.masks = None
+        n = np.load(self.file, mmap_mode = "r").shape[0]
+        if n < length:
+            raise RuntimeError(f"{self.file} has masks for {n}/{length} samples, rerun misc/precompute_masks.py")
+
+    def __getitem__(self, index):
+        if self.masks is None: # opened lazily per loader worker
+            self.masks = np.load(self.file, mmap_mode = "r")
+        res = self.resolution
+        bits = np.unpackbits(self.masks[index])[:res * res]
+        return torch.from_numpy(bits.astype(np.int64)).view(1, res, res)
+
+    def get(self, index, flip = False):
+        # stored masks are computed on unflipped clips, flipped clips need a flipped mask
+        mask = self[index]
+        return mask.flip(2) if flip else mask
@@ -0,0 +1,51 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+_kernels = {}
+
+# 2d gaussian as depthwise conv weight (1 x 1 x k x k), built once per size/device/dtype
+# https://discuss.pytorch.org/t/is-there-anyway-to-do-gaussian-filtering-for-an-image-2d-3d-in-pytorch/12351/7
+def gaussian_kernel(kernel_size, sigma, device, dtype):
+    key = (kernel_size, sigma, device, dtype)
+    kernel = _kernels.get(key)
+    if kernel is None:
+        grid = torch.arange(kernel_size, dtype=torch.float32)
+        mean = (kernel_size - 1) / 2
+        kernel_1d = 1 / (sigma * math.sqrt(2 * math.pi)) * torch.exp(-((grid - mean) / (2 * sigma)) ** 2)
+        kernel = kernel_1d[:, None] * kernel_1d[None, :]
+        kernel = (kernel / torch.sum(kernel)).view(1, 1, kernel_size, kernel_size).to(device=device, dtype=dtype)
+        _kernels[key] = kernel
+    return kernel
+
+
+def motion_segmentation(x, eps = 1e-3, num_offsets = 3, offset_offsets = 3, smooth_kernel = 5, smooth_sigma = 1):
+    """
+    Mask of the pixels that move in a clip: T x H x W x C -> H x W x 1, or batched B x T x H x W x C -> B x H x W x 1 (long).
+    A pixel moves if its summed abs. difference to the frame o steps earlier, averaged over T, exceeds eps for any
+    o in offset_offsets * (1..num_offsets). Works on any device, uint8 clips are converted to float.
+    """
+    batched = x.dim() == 5
+    if not batched:
+        assert x.dim() == 4
+        x = x.unsqueeze(0)
+    if not x.is_floating_point():
+        x = x.float()
+    B, T, H, W, C = x.shape
+    moving = torch.zeros((B, H, W), dtype=torch.bool, device=x.device)
+    for o in range(1, num_offsets+1):
+        o = o * offset_offsets
+        if o >= T: # the first o frames are compared to themselves
+            break
+        # strided views of the clip instead of a shifted copy
+        td = torch.abs(x[:, o:] - x[:, :-o]).sum(dim = (1, 4)) / T
+        moving |= td > eps
+    seg = moving.unsqueeze(1)
+    if smooth_kernel > 0:
+        pad = smooth_kernel // 2
+        seg = F.pad(seg.to(x.dtype), (pad, pad, pad, pad), mode='reflect')
+        seg = F.conv2d(seg, gaussian_kernel(smooth_kernel, smooth_sigma, x.device, x.dtype))
+        seg = seg > 1./smooth_kernel
+    seg = seg.permute(0,2,3,1).long()
+    return seg if batched else seg[0]
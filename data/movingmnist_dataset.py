@@ -4,7 +4,7 @@ import torch
 import torchvision
 import sys
 import os
-from data.base_dataset import BaseDataset
+from data.base_dataset import BaseDataset, select_frames
 import torch.utils.data as data
 from PIL import Image
 import os.path
@@ -34,15 +34,11 @@ class MovingMNISTDataset(BaseDataset):
     def __getitem__(self, index):
        
         seq, tar = self.dataset[index]
-        frames = torch.cat([seq,tar], 0).unsqueeze(-1)
-        frames = torch.cat([frames]*self.input_nc,-1) # b/w ->rgb
-
+        frames = torch.cat([seq,tar], 0)
         if self.skip_frames>1: 
-            T,C,H,W = frames.shape
-            skipped = torch.zeros(T//self.skip_frames, C,H,W)
-            for i in range(T//self.skip_frames):
-                skipped[i] = frames[i*self.skip_frames]
-            frames = skipped
+            T = frames.shape[0]
+            frames = frames[select_frames(T, T//self.skip_frames, self.skip_frames)]
+        frames = frames.unsqueeze(-1).expand(-1,-1,-1,self.input_nc) # b/w ->rgb
 
         return {'VIDEO':frames}
 
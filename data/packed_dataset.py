@@ -0,0 +1,56 @@
+import torch
+import os
+from data.base_dataset import BaseDataset, select_frames
+from data.mask_store import MaskStore
+from data.motion_segmentation import motion_segmentation
+from data.packed_sequences import PackedSequences, decode_frames
+import torch.nn.functional as F
+import torchvision.transforms as transforms
+
+# image sequences packed into tar shards by misc/pack_sequences.py (expects <dataroot>/<phase>/index.json)
+class PackedDataset(BaseDataset): 
+
+    def initialize(self, opt):
+        self.root = opt.dataroot if opt.validation_set == "split" else os.path.join(opt.dataroot, opt.phase)
+
+        self.max_clip_length = opt.max_clip_length
+        self.fps = opt.fps
+        self.skip_frames = opt.skip_frames
+        self.nframes = int(opt.fps * opt.max_clip_length // opt.skip_frames)
+        self.packed = PackedSequences(self.root)
+
+        # long sequences are cut into consecutive windows like SkyDataset does, short ones yield a single (padded) window
+        window = self.nframes * self.skip_frames
+        self.samples = []
+        for i in range(len(self.packed)):
+            n = self.packed.nframes(i)
+            self.samples += [(i, w * window) for w in range(max(1, n // window))]
+
+        self.len = int(min(opt.max_dataset_size, len(self.samples)))
+        self.resolution = opt.resolution
+        print(f"nframes: {self.nframes}")
+        self.init_clip_preprocessing(opt)
+        self.use_segmentation = (opt.use_segmentation or opt.masked_update) and not opt.segmentation_on_device
+        self.seg_eps = opt.motion_seg_eps
+        self.mask_store = None
+        if self.use_segmentation and opt.precomputed_masks: 
+            self.mask_store = MaskStore(opt, self.len)
+
+    def __len__(self): 
+        return self.len
+
+    def __getitem__(self, index):
+        with torch.no_grad(): 
+            out = {}
+            seq, start = self.samples[index]
+            encoded = self.packed.read(seq)
+            if len(encoded) - start < self.nframes*self.skip_frames: 
+                print(f"ERROR: id: {index} has {len(encoded) - start}/{self.nframes*self.skip_frames} frames. Sequence: {self.packed.index[seq]['key']}")
+            frames = decode_frames(encoded, select_frames(len(encoded), self.nframes, self.skip_frames, start = start).tolist())
+
+            out['VIDEO'], flip = self.preprocess_video(frames, self.nframes)
+            if self.mask_store is not None: 
+                out['SEGMENTATION'] = self.mask_store.get(index, flip)
+            if self.use_segmentation and self.mask_store is None: 
+                out['SEGMENTATION'] = motion_segmentation(out['VIDEO'].float(), eps = self.seg_eps).permute(2,0,1)
+            return out
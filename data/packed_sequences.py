@@ -0,0 +1,87 @@
+import os
+import io
+import json
+import pickle
+import tarfile
+from PIL import Image
+import numpy as np
+import torch
+
+from data.base_dataset import frame_sort_key
+from data.shards import WorkerLocal
+
+IMG_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.ppm', '.bmp']
+
+# every directory that directly contains frames is one sequence (BAIR: <traj>/<seq>/, sky: <video>/<clip>/)
+def find_sequences(root):
+    sequences = []
+    for dir, _, files in os.walk(root):
+        frames = [f for f in files if os.path.splitext(f)[1].lower() in IMG_EXTENSIONS]
+        if len(frames) > 0:
+            frames = sorted(frames, key = frame_sort_key)
+            sequences.append((os.path.relpath(dir, root), [os.path.join(dir, f) for f in frames]))
+    return sorted(sequences, key = lambda s: frame_sort_key(s[0]))
+
+def pack(sequences, out_dir, shard_size = 1024 ** 3):
+    """
+    Writes every sequence as one tar member holding the pickled list of its (already encoded) frame files.
+    Members are appended to sequential shards of ~shard_size bytes, index.json maps each sequence to
+    (shard, offset, size), so a reader gets a whole clip with a single seek + read.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    index = []
+    shard, tar = -1, None
+    for i, (key, frame_files) in enumerate(sequences):
+        if tar is None or tar.offset > shard_size:
+            if tar is not None:
+                tar.close()
+            shard += 1
+            tar = tarfile.open(os.path.join(out_dir, "shard_%05d.tar" % shard), "w")
+        frames = []
+        for f in frame_files:
+            with open(f, "rb") as fp:
+                frames.append(fp.read())
+        record = pickle.dumps(frames, protocol = pickle.HIGHEST_PROTOCOL)
+        info = tarfile.TarInfo("%08d.pkl" % i)
+        info.size = len(record)
+        tar.addfile(info, io.BytesIO(record))
+        # addfile keeps a copy of info (offset_data unset), the payload is the last (block padded) chunk written
+        offset = tar.offset - tarfile.BLOCKSIZE * ((info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+        index.append({"key": key, "shard": shard, "offset": offset, "size": info.size, "nframes": len(frames)})
+        if i % 1000 == 0:
+            print(f"packing: {i+1}/{len(sequences)}")
+    if tar is not None:
+        tar.close()
+    with open(os.path.join(out_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+class PackedSequences(WorkerLocal):
+    worker_local = {"files": {}}
+
+    def __init__(self, dir):
+        self.dir = dir
+        with open(os.path.join(dir, "index.json")) as f:
+            self.index = json.load(f)
+        self.files = {} # opened lazily per loader worker
+
+    def __len__(self):
+        return len(self.index)
+
+    def nframes(self, i):
+        return self.index[i]["nframes"]
+
+    def read(self, i):
+        # one seek + one read per clip, returns the list of encoded frames
+        entry = self.index[i]
+        f = self.files.get(entry["shard"])
+        if f is None:
+            f = open(os.path.join(self.dir, "shard_%05d.tar" % entry["shard"]), "rb")
+            self.files[entry["shard"]] = f
+        f.seek(entry["offset"])
+        return pickle.loads(f.read(entry["size"]))
+
+def decode_frames(encoded, indices):
+    # T x H x W x C uint8, only the selected frames are decoded
+    return torch.stack([torch.from_numpy(np.asarray(Image.open(io.BytesIO(encoded[i])).convert("RGB"))) for i in indices], dim = 0)
@@ -0,0 +1,79 @@
+import threading
+import queue
+import torch
+
+
+def to_device(data, device, non_blocking = True):
+    return {k: v.to(device, non_blocking=non_blocking) if torch.is_tensor(v) else v for k, v in data.items()}
+
+
+def cuda_prefetch(batches, device):
+    """
+    Copies batch i+1 to the device on a side stream while the caller still works on batch i.
+    Needs pinned batches to actually overlap (see CustomDatasetDataLoader).
+    """
+    stream = torch.cuda.Stream(device)
+    def stage(data):
+        with torch.cuda.stream(stream):
+            return to_device(data, device)
+
+    batches = iter(batches)
+    try:
+        next_data = stage(next(batches))
+    except StopIteration:
+        return
+    while next_data is not None:
+        torch.cuda.current_stream(device).wait_stream(stream)
+        data = next_data
+        for v in data.values():
+            if torch.is_tensor(v):
+                v.record_stream(torch.cuda.current_stream(device)) # keep the allocator from reusing it too early
+        try:
+            next_data = stage(next(batches))
+        except StopIteration:
+            next_data = None
+        yield data
+
+
+def thread_prefetch(batches, size = 2):
+    """
+    CPU fallback: a background thread keeps up to size batches ready in a queue.
+    Exceptions raised while loading are re-raised in the consumer.
+    """
+    q = queue.Queue(maxsize = size)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for data in batches:
+                while not stop.is_set():
+                    try:
+                        q.put(data, timeout = 1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            q.put(done)
+        except Exception as e:
+            q.put(e)
+
+    thread = threading.Thread(target = produce, daemon = True)
+    thread.start()
+    try:
+        while True:
+            data = q.get()
+            if data is done:
+                break
+            if isinstance(data, Exception):
+                raise data
+            yield data
+    finally:
+        stop.set()
+
+
+def prefetch(batches, device, size = 2):
+    if device.type == "cuda":
+        return cuda_prefetch(batches, device)
+    return thread_prefetch(batches, size)
@@ -0,0 +1,88 @@
+import os
+import json
+import multiprocessing
+from PIL import Image
+import av
+from data.distributed import tmp_path
+
+
+def probe_video(job):
+    # decodes (without converting) every frame between start and end (seconds) to count the frames that really decode
+    file_name, start, end = job
+    try:
+        with av.open(file_name) as container:
+            stream = container.streams.video[0]
+            time_base = float(stream.time_base)
+            fps = float(stream.average_rate) if stream.average_rate else 0
+            target = int(start / time_base)
+            if target > 0:
+                container.seek(target, stream=stream, backward=True, any_frame=False)
+            n = 0
+            for frame in container.decode(stream):
+                if frame.pts is not None and frame.pts < target:
+                    continue
+                if end is not None and frame.pts is not None and frame.pts * time_base > end:
+                    break
+                n += 1
+            return {"frames": n, "fps": fps, "resolution": [stream.height, stream.width]}
+    except (av.AVError, IndexError, OSError) as e:
+        return {"frames": 0, "fps": 0, "resolution": [0, 0], "error": str(e)}
+
+def probe_frames(job):
+    # image sequence: indices of the frames that decode
+    files, = job
+    valid, resolution = [], [0, 0]
+    for i, f in enumerate(files):
+        try:
+            with Image.open(f) as img:
+                img.load()
+                resolution = [img.height, img.width]
+            valid.append(i)
+        except OSError:
+            pass
+    return {"frames": len(valid), "valid": valid, "fps": 0, "resolution": resolution}
+
+def probe_file(root, name):
+    return os.path.join(root, "." + name + "_probe.json")
+
+def _signature(path):
+    # None: missing / unreadable, the entry counts as failed
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+def probe_clips(file, keys, paths, jobs, probe, n_workers = 8, rescan = False):
+    """
+    Returns probe(job) for every clip, cached in file by key and only rerun for clips whose path
+    (video file or frame directory) changed since they were probed. Probing runs in n_workers processes.
+    """
+    cache = {}
+    if not rescan and os.path.exists(file):
+        with open(file) as f:
+            cache = json.load(f)
+    signatures = [_signature(p) for p in paths]
+    missing = {k: {"frames": 0, "valid": [], "fps": 0, "resolution": [0, 0], "error": f"{p} not found"} for k, p, sig in zip(keys, paths, signatures) if sig is None}
+    if len(missing) > 0:
+        print(f"{len(missing)}/{len(keys)} clips are missing on disk")
+    todo = [i for i, k in enumerate(keys) if k not in missing and (k not in cache or cache[k]["signature"] != signatures[i])]
+    if len(todo) > 0:
+        print(f"probing {len(todo)}/{len(keys)} clips")
+        with multiprocessing.Pool(n_workers) as pool:
+            for n, (i, result) in enumerate(zip(todo, pool.imap(probe, [jobs[i] for i in todo], chunksize = 4))):
+                result["signature"] = signatures[i]
+                cache[keys[i]] = result
+                if n % 1000 == 0:
+                    print(f"probing: {n+1}/{len(todo)}")
+        try:
+            with open(tmp_path(file), "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path(file), file)
+        except OSError as e: # read only dataset, probe every time
+            print(f"could not write probe manifest {file}: {e}")
+    return [missing[k] if k in missing else cache[k] for k in keys]
+
+def report(name, n_before, n_after):
+    if n_after < n_before:
+        print(f"{name}: dropped {n_before - n_after}/{n_before} clips that are too short or do not decode")
@@ -0,0 +1,72 @@
+import torch
+import torchvision
+import torch.nn.functional as F
+from data.base_dataset import BatchRenderedDataset
+
+
+def bounce(start, velocity, t, length):
+    # position of a point moving with constant velocity between two walls at 0 and length (triangle wave)
+    q = torch.remainder(start + velocity * t, 2 * length)
+    return length - torch.abs(q - length)
+
+
+def render_moving_digits(digits, nframes, resolution, speed, generator = None):
+    """
+    Renders a batch of bouncing-digit sequences: digits (B x D x s x s, uint8) -> B x T x res x res uint8.
+    Start positions and directions are random, every digit moves with `speed` pixels per frame
+    and overlapping digits are combined with max, like MovingMNIST.
+    """
+    B, D, s, _ = digits.shape
+    length = resolution - s
+    start = torch.rand((B, D, 1, 2), generator = generator) * length
+    angle = torch.rand((B, D, 1, 1), generator = generator) * 2 * 3.141592653589793
+    velocity = torch.cat([torch.cos(angle), torch.sin(angle)], dim = -1) * speed
+    t = torch.arange(nframes, dtype = torch.float32).view(1, 1, nframes, 1)
+    pos = bounce(start, velocity, t, length).round_().long() # B x D x T x 2
+
+    # flat canvas index of every digit pixel in every frame
+    bt = torch.arange(B * nframes).view(B, nframes, 1, 1)
+    offsets = torch.arange(s)
+    canvas = torch.zeros(B * nframes * resolution * resolution, dtype = torch.uint8)
+    for d in range(D):
+        y = pos[:, d, :, 0].view(B, nframes, 1, 1) + offsets.view(1, 1, s, 1)
+        x = pos[:, d, :, 1].view(B, nframes, 1, 1) + offsets.view(1, 1, 1, s)
+        index = ((bt * resolution + y) * resolution + x).view(-1)
+        values = digits[:, d].unsqueeze(1).expand(-1, nframes, -1, -1).reshape(-1)
+        canvas[index] = torch.max(canvas[index], values)
+    return canvas.view(B, nframes, resolution, resolution)
+
+
+# bouncing MNIST digits generated on the fly from local MNIST (<dataroot>/MNIST), every item is a whole batch
+class ProceduralMNISTDataset(BatchRenderedDataset):
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--num_digits', type=int, default=2, help='digits per sequence')
+        parser.add_argument('--digit_size', type=int, default=28, help='size of the digits in pixels')
+        parser.add_argument('--digit_speed', type=float, default=3.0, help='speed of the digits in pixels per frame')
+        parser.add_argument('--procedural_epoch_size', type=int, default=10000, help='number of sequences per epoch')
+        parser.add_argument('--procedural_seed', type=int, default=-1, help='seed >= 0: reproducible stream, new batches every training epoch and a fixed set for validation/test (otherwise unseeded)')
+        return parser
+
+    def initialize(self, opt):
+        mnist = torchvision.datasets.MNIST(opt.dataroot, train = opt.phase == "train", download = False)
+        digits = mnist.data
+        if opt.digit_size != digits.size(-1):
+            digits = F.interpolate(digits.unsqueeze(1).float(), size = (opt.digit_size, opt.digit_size), mode = "bilinear", align_corners=False)
+            digits = digits.squeeze(1).round_().clamp_(0, 255).to(torch.uint8)
+        self.digits = digits
+        assert opt.resolution > opt.digit_size, "resolution has to be larger than the digits"
+
+        self.nframes = int(opt.fps * opt.max_clip_length // opt.skip_frames)
+        self.resolution = opt.resolution
+        self.input_nc = opt.input_nc
+        self.num_digits = opt.num_digits
+        self.speed = opt.digit_speed
+        self.init_batches(opt, opt.procedural_epoch_size, opt.procedural_seed)
+
+    def render(self, B, generator = None):
+        choice = torch.randint(len(self.digits), (B, self.num_digits), generator = generator)
+        frames = render_moving_digits(self.digits[choice], self.nframes, self.resolution, self.speed, generator = generator)
+        frames = frames.unsqueeze(-1).expand(-1, -1, -1, -1, self.input_nc) # b/w ->rgb
+        return {'VIDEO': frames}
@@ -0,0 +1,79 @@
+import os
+import copy
+import numpy as np
+import torch
+from data.distributed import tmp_path
+
+
+class WorkerLocal():
+    """
+    Open files / memory maps are not pickled: the attributes in worker_local are reset to their value there when a
+    loader worker receives the object, so every worker opens its own.
+    """
+    worker_local = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update({k: copy.copy(v) for k, v in self.worker_local.items()})
+        return state
+
+
+class ShardWriter():
+    """
+    Appends uint8 clips (T x H x W x C) to sequential .npy shards of ~shard_frames frames in dir.
+    close() writes index.npy (clip -> shard, offset, length) last, it marks the shards as complete.
+    """
+    def __init__(self, dir, size, shard_frames):
+        self.dir = dir
+        self.size = size
+        self.shard_frames = shard_frames
+        self.buffer, self.buffered, self.shard = [], 0, 0
+        self.index = []
+        os.makedirs(dir, exist_ok=True)
+
+    def flush(self):
+        data = np.concatenate(self.buffer) if len(self.buffer) > 0 else np.zeros((0, self.size, self.size, 3), dtype = np.uint8)
+        np.save(os.path.join(self.dir, "shard_%05d.npy" % self.shard), data)
+        self.buffer, self.buffered, self.shard = [], 0, self.shard + 1
+
+    def add(self, frames):
+        frames = frames.numpy() if isinstance(frames, torch.Tensor) else frames
+        if self.buffered > 0 and self.buffered + frames.shape[0] > self.shard_frames:
+            self.flush()
+        self.index.append((self.shard, self.buffered, frames.shape[0]))
+        self.buffer.append(frames)
+        self.buffered += frames.shape[0]
+
+    def close(self):
+        self.flush()
+        index_file = os.path.join(self.dir, "index.npy")
+        np.save(tmp_path(index_file), np.array(self.index, dtype = np.int64).reshape(-1, 3))
+        os.replace(tmp_path(index_file), index_file)
+
+
+class ShardReader(WorkerLocal):
+    # clips of a ShardWriter directory as zero-copy views into the mapped shards
+    worker_local = {"shards": None}
+
+    def __init__(self, dir):
+        self.dir = dir
+        self.index = np.load(os.path.join(dir, "index.npy"))
+        self.shards = None # opened lazily per loader worker
+
+    def _open(self):
+        n_shards = int(self.index[:,0].max()) + 1 if len(self.index) > 0 else 0
+        # copy on write mapping: reads are zero-copy, torch.from_numpy does not complain about read-only memory
+        self.shards = [np.load(os.path.join(self.dir, "shard_%05d.npy" % s), mmap_mode="c") for s in range(n_shards)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def num_frames(self, index):
+        return int(self.index[index, 2])
+
+    def frames(self, index):
+        # T x H x W x C array of clip index (a view, index it to copy only some frames)
+        if self.shards is None:
+            self._open()
+        shard, offset, n = self.index[index]
+        return self.shards[shard][offset: offset + n]
@@ -1,15 +1,18 @@
 import torch
 import torchvision
+import numpy as np
 import pandas as pd
 from PIL import Image
 import sys
 import glob
 import os
-import random
-from data.base_dataset import BaseDataset
+from data.base_dataset import BaseDataset, select_frames
+from data.mask_store import MaskStore
+from data.motion_segmentation import motion_segmentation
+from data.manifest import load_manifest
+from data.probe import probe_clips, probe_file, probe_frames
 import torch.nn.functional as F
 import torchvision.transforms as transforms
-from torchvideotransforms import video_transforms, volume_transforms
 
 import torch.hub
 import math
@@ -31,35 +34,53 @@ def find_classes(dir):
 def is_image_file(filename):
     return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
 
-def make_dataset(dir, nframes, class_to_idx):
-    images = []
-    n_video = 0
-    n_clip = 0
+def scan_sequences(dir):
+    # [target, clip dir, [frames]] relative to dir, the only part of the dataset that touches the file system
+    sequences = []
+    dirs = ["."]
     for target in sorted(os.listdir(dir)):
         if os.path.isdir(os.path.join(dir,target))==True:
-            n_video +=1
             # eg: dir + '/rM7aPu9WV2Q'
+            dirs.append(target)
             subfolder_path = os.path.join(dir, target) 
             for subsubfold in sorted(os.listdir(subfolder_path) ):
                 if os.path.isdir(os.path.join(subfolder_path, subsubfold) ):
                 	# eg: dir + '/rM7aPu9WV2Q/1'
-                    n_clip += 1
-                    subsubfolder_path = os.path.join(subfolder_path, subsubfold) 
-                    
-                    item_frames = []
-                    i = 1
-                    for fi in sorted( os.listdir(subsubfolder_path) ):
-                        if  is_image_file(fi):
-                        # fi is an image in the subsubfolder
-                            file_name = fi
-                            # eg: dir + '/rM7aPu9WV2Q/1/rM7aPu9WV2Q_frames_00086552.jpg'
-                            file_path = os.path.join(subsubfolder_path,file_name) 
-                            item = (file_path, class_to_idx[target])
-                            item_frames.append(item)
-                            if i %nframes == 0 and i >0 :
-                                images.append(item_frames) # item_frames is a list containing n frames. 
-                                item_frames = []
-                            i = i+1
+                    clip = os.path.join(target, subsubfold)
+                    dirs.append(clip)
+                    frames = [fi for fi in sorted(os.listdir(os.path.join(dir, clip))) if is_image_file(fi)]
+                    sequences.append([target, clip, frames])
+    return sequences, dirs
+
+def make_dataset(dir, nframes, class_to_idx, rescan = False, probe_workers = None):
+    images = []
+    n_video = 0
+    n_clip = 0
+    sequences = load_manifest(dir, "sky", scan_sequences, rescan = rescan)
+    if probe_workers is not None: 
+        # broken frames are removed before the sequences are cut into samples
+        jobs = [([os.path.join(dir, clip, f) for f in frames],) for _, clip, frames in sequences]
+        probes = probe_clips(probe_file(dir, "sky"), [clip for _, clip, _ in sequences], [os.path.join(dir, clip) for _, clip, _ in sequences], jobs, probe_frames, n_workers = probe_workers, rescan = rescan)
+        n_broken = sum(len(frames) - p['frames'] for (_, _, frames), p in zip(sequences, probes))
+        if n_broken > 0: 
+            print(f"{dir}: dropped {n_broken} frames that do not decode")
+        sequences = [(target, clip, [frames[i] for i in p['valid']]) for (target, clip, frames), p in zip(sequences, probes)]
+    videos = set()
+    for target, clip, frames in sequences:
+        videos.add(target)
+        n_clip += 1
+        item_frames = []
+        i = 1
+        for file_name in frames:
+            # eg: dir + '/rM7aPu9WV2Q/1/rM7aPu9WV2Q_frames_00086552.jpg'
+            file_path = os.path.join(dir, clip, file_name) 
+            item = (file_path, class_to_idx[target])
+            item_frames.append(item)
+            if i %nframes == 0 and i >0 :
+                images.append(item_frames) # item_frames is a list containing n frames. 
+                item_frames = []
+            i = i+1
+    n_video = len(videos)
     print('number of long videos:')
     print(n_video)
     print('number of short videos')
@@ -67,73 +88,6 @@ def make_dataset(dir, nframes, class_to_idx):
     return images
 
 
-#https://discuss.pytorch.org/t/is-there-anyway-to-do-gaussian-filtering-for-an-image-2d-3d-in-pytorch/12351/7
-class GaussianSmoothing(nn.Module):
-    """
-    Apply gaussian smoothing on a
-    1d, 2d or 3d tensor. Filtering is performed seperately for each channel
-    in the input using a depthwise convolution.
-    Arguments:
-        channels (int, sequence): Number of channels of the input tensors. Output will
-            have this number of channels as well.
-        kernel_size (int, sequence): Size of the gaussian kernel.
-        sigma (float, sequence): Standard deviation of the gaussian kernel.
-        dim (int, optional): The number of dimensions of the data.
-            Default value is 2 (spatial).
-    """
-    def __init__(self, channels, kernel_size, sigma, dim=2):
-        super(GaussianSmoothing, self).__init__()
-        if isinstance(kernel_size, numbers.Number):
-            kernel_size = [kernel_size] * dim
-        if isinstance(sigma, numbers.Number):
-            sigma = [sigma] * dim
-
-        # The gaussian kernel is the product of the
-        # gaussian function of each dimension.
-        kernel = 1
-        meshgrids = torch.meshgrid(
-            [
-                torch.arange(size, dtype=torch.float32)
-                for size in kernel_size
-            ]
-        )
-        for size, std, mgrid in zip(kernel_size, sigma, meshgrids):
-            mean = (size - 1) / 2
-            kernel *= 1 / (std * math.sqrt(2 * math.pi)) * \
-                      torch.exp(-((mgrid - mean) / (2 * std)) ** 2)
-
-        # Make sure sum of values in gaussian kernel equals 1.
-        kernel = kernel / torch.sum(kernel)
-
-        # Reshape to depthwise convolutional weight
-        kernel = kernel.view(1, 1, *kernel.size())
-        kernel = kernel.repeat(channels, *[1] * (kernel.dim() - 1))
-
-        self.register_buffer('weight', kernel)
-        self.groups = channels
-
-        if dim == 1:
-            self.conv = F.conv1d
-        elif dim == 2:
-            self.conv = F.conv2d
-        elif dim == 3:
-            self.conv = F.conv3d
-        else:
-            raise RuntimeError(
-                'Only 1, 2 and 3 dimensions are supported. Received {}.'.format(dim)
-            )
-
-    def forward(self, input):
-        """
-        Apply gaussian filter to input.
-        Arguments:
-            input (torch.Tensor): Input to apply gaussian filter on.
-        Returns:
-            filtered (torch.Tensor): Filtered output.
-        """
-        input = F.pad(input, (2, 2, 2, 2), mode='reflect')
-        return self.conv(input, weight=self.weight, groups=self.groups)
-
 def deeplab_inference(model, image, raw_image=None, postprocessor=None):
     with torch.no_grad(): 
         _, _, H, W = image.shape
@@ -152,24 +106,6 @@ def deeplab_inference(model, image, raw_image=None, postprocessor=None):
 
     return logits, probs, labelmap  
 
-def motion_segmentation(x, eps = 1e-3, channel_dim = -1, num_offsets = 3, offset_offsets = 3, smooth_kernel = 5, smooth_sigma = 1): 
-    assert len(x.shape) == 4
-    seg = 0
-    for o in range(1,num_offsets+1):
-        o = o * offset_offsets
-        td = x - torch.cat([x[:o,...], x[:-o]]) 
-        td = torch.abs(td)
-        td = torch.sum(td, dim = channel_dim, keepdim = True)
-        motion_seg = torch.sum(td, dim = 0) / x.size(0)
-        motion_seg = motion_seg > eps
-        seg = seg + motion_seg
-    seg = seg>0
-    if smooth_kernel>0: 
-        smoothing = GaussianSmoothing(1, smooth_kernel, smooth_sigma)
-        seg = smoothing(seg.permute(2,0,1).float().unsqueeze(0)).squeeze(0).permute(1,2,0)
-        seg = seg > 1./smooth_kernel
-    return seg.long()
-
 #expected header in info.csv: video_id,file_name,resolution,fps,start,end
 class SkyDataset(BaseDataset): 
 
@@ -186,7 +122,7 @@ class SkyDataset(BaseDataset):
         self.nframes = int(opt.fps * opt.max_clip_length // opt.skip_frames)
 
         classes, class_to_idx = find_classes(self.root)
-        imgs = make_dataset(self.root, self.nframes,  class_to_idx)
+        imgs = make_dataset(self.root, self.nframes * self.skip_frames,  class_to_idx, rescan = opt.reparse_data, probe_workers = opt.probe_workers if opt.probe_clips else None)
         if len(imgs) == 0:
             raise(RuntimeError("Found 0 images in subfolders of: " + self.root + "\n"
                                "Supported image extensions are: " + 
@@ -198,17 +134,12 @@ class SkyDataset(BaseDataset):
         self.len = int(min(opt.max_dataset_size, len(self.samples)))
         self.resolution = opt.resolution
         print(f"nframes: {self.nframes}")
-        if opt.phase == "train" and not opt.no_augmentation: 
-            self.augmentation = transforms.Compose([
-            #  torchvision.transforms.ColorJitter(brightness=.1, contrast=.1, saturation=.1, hue=.1),
-            # video_transforms.RandomCrop((self.resolution,self.resolution)),
-                video_transforms.RandomHorizontalFlip(),
-                volume_transforms.ClipToTensor(),
-            ])
-        else: 
-            self.augmentation = None
-        self.use_segmentation = opt.use_segmentation or opt.masked_update
+        self.init_clip_preprocessing(opt)
+        self.use_segmentation = (opt.use_segmentation or opt.masked_update) and not opt.segmentation_on_device
         self.seg_eps = opt.motion_seg_eps
+        self.mask_store = None
+        if self.use_segmentation and opt.precomputed_masks: 
+            self.mask_store = MaskStore(opt, self.len)
 
     def __len__(self): 
         return self.len
@@ -217,28 +148,16 @@ class SkyDataset(BaseDataset):
         with torch.no_grad(): 
             out = {}
             dir = self.samples[index]
-            frame_list = [transforms.ToTensor()(Image.open(frame).convert("RGB")) for frame,label in  dir]
+            if len(dir) < self.nframes*self.skip_frames: 
+                print(f"ERROR: id: {index} has {len(dir)}/{self.nframes*self.skip_frames} frames. File name: {dir}")
+            # only open the frames that survive skip_frames
+            frame_list = [torch.from_numpy(np.asarray(Image.open(dir[i][0]).convert("RGB"))) for i in select_frames(len(dir), self.nframes, self.skip_frames).tolist()]
+            frames = torch.stack(frame_list, dim = 0)
 
-            frames = torch.stack(frame_list, dim = 0).permute(0,2,3,1)*255
-
-            if frames.shape[0] < self.nframes*self.skip_frames: 
-                print(f"ERROR: id: {index} has {frames.shape[0]}/{self.nframes*self.skip_frames} frames. File name: {dir}")
-                missing = self.nframes * self.skip_frames - frames.shape[0]
-                frames = torch.cat([frames, frames[-1,...].repeat(missing, 1, 1, 1)])
-
-            if self.skip_frames>1: 
-                T,C,H,W = frames.shape
-                skipped = torch.zeros(T//self.skip_frames, C,H,W)
-                for i in range(T//self.skip_frames):
-                    skipped[i] = frames[i*self.skip_frames]
-                frames = skipped
             first_frame = frames[0]
-            frames = frames[:self.nframes,...].float()
-            frames = F.interpolate(frames.permute(0,3,1,2), size = (self.resolution, self.resolution), mode = "bilinear", align_corners=False).permute(0,2,3,1)
-
-            if self.augmentation: 
-                frames = self.augmentation(frames.numpy()).permute(1,2,3,0) *255
-            out['VIDEO'] = frames
+            out['VIDEO'], flip = self.preprocess_video(frames, self.nframes)
+            if self.mask_store is not None: 
+                out['SEGMENTATION'] = self.mask_store.get(index, flip)
             # if self.use_segmentation: 
             #     first_frame = frames[0].permute(2,0,1).unsqueeze(0)
             #     logits, probs, labelmap = deeplab_inference(self.deeplab, first_frame)
@@ -248,8 +167,8 @@ class SkyDataset(BaseDataset):
             #     out['SEGMENTATION'] = staticmap.unsqueeze(0)
             #     print(f"found: {[(x, self.label_dict[x]) for x in torch.unique(labelmap).tolist()]}")
             #     #out['SEGMENTATION'] = probs
-            if self.use_segmentation: 
-                out['SEGMENTATION'] = motion_segmentation(frames, eps = self.seg_eps).permute(2,0,1)
+            if self.use_segmentation and self.mask_store is None: 
+                out['SEGMENTATION'] = motion_segmentation(out['VIDEO'].float(), eps = self.seg_eps).permute(2,0,1)
             return out
 
 
@@ -0,0 +1,45 @@
+import torch
+from data.base_dataset import BatchRenderedDataset
+
+
+def render_moving_boxes(B, nframes, resolution, size, generator = None):
+    """
+    Same clips as DummyDataset for a whole batch at once, without any data on disk: a box of random colour
+    moves from left to right over a random (noise) background, at a random height.
+    Returns B x T x res x res x 3 uint8.
+    """
+    background = torch.randint(0, 256, (B, 1, resolution, resolution, 3), dtype = torch.uint8, generator = generator)
+    color = torch.randint(0, 256, (B, 1, 1, 1, 3), dtype = torch.uint8, generator = generator)
+
+    start_pos = size//2 + 1
+    end_pos = resolution - (size//2 + 1)
+    d = (end_pos - start_pos) / nframes
+    x = (start_pos + (torch.arange(nframes) * d).long() - size // 2).view(1, nframes, 1, 1) # left edge per frame
+    y = torch.randint(size, resolution - size, (B, 1, 1, 1), generator = generator) # top edge per clip
+
+    pixels = torch.arange(resolution)
+    inside_x = (pixels.view(1, 1, 1, -1) >= x) & (pixels.view(1, 1, 1, -1) < x + size)
+    inside_y = (pixels.view(1, 1, -1, 1) >= y) & (pixels.view(1, 1, -1, 1) < y + size)
+    box = (inside_x & inside_y).unsqueeze(-1) # B x T x res x res x 1
+    return torch.where(box, color, background)
+
+
+# moving boxes rendered on the fly for benchmarking the training loop without I/O, every item is a whole batch
+class SyntheticDataset(BatchRenderedDataset):
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--box_size', type=int, default=6, help='size of the moving box in pixels')
+        parser.add_argument('--synthetic_epoch_size', type=int, default=10000, help='number of clips per epoch')
+        parser.add_argument('--synthetic_seed', type=int, default=-1, help='seed >= 0: reproducible stream, new batches every training epoch and a fixed set for validation/test (otherwise unseeded)')
+        return parser
+
+    def initialize(self, opt):
+        self.nframes = int(opt.fps * opt.max_clip_length // opt.skip_frames)
+        self.resolution = opt.resolution
+        self.size = opt.box_size
+        assert self.resolution > 2 * self.size, "resolution has to be larger than 2 * box_size"
+        self.init_batches(opt, opt.synthetic_epoch_size, opt.synthetic_seed)
+
+    def render(self, B, generator = None):
+        return {'VIDEO': render_moving_boxes(B, self.nframes, self.resolution, self.size, generator = generator)}
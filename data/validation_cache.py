@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import torch
+
+from data.base_dataset import to_uint8
+
+
+class ValidationCache():
+    """
+    Serves the validation set from memory after the first pass: every batch of the first pass is stored as uint8,
+    in RAM (pinned if cuda is available) or, above max_bytes, in a memory mapped .npy in cache_dir.
+    VideoDataset validation sets use the first window of every clip, so validation is also reproducible
+    (a --validation_set split shares its dataset with training and keeps the windows drawn in the first pass).
+    """
+    def __init__(self, loader, max_bytes, cache_dir):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.data = None
+        self.batch_size = loader.opt.batch_size
+        if hasattr(loader.dataset, "fixed_start"):
+            loader.dataset.fixed_start = True
+
+    def __len__(self):
+        return len(self.loader)
+
+    def load_data(self):
+        return self
+
+    def storage(self, key, shape):
+        nbytes = int(np.prod(shape))
+        if nbytes <= self.max_bytes:
+            data = torch.empty(shape, dtype = torch.uint8)
+            return data.pin_memory() if torch.cuda.is_available() else data
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file = os.path.join(self.cache_dir, key + ".npy")
+        print(f"validation cache: {nbytes / 1024 ** 2:.0f} MB of {key} -> {file}")
+        return torch.from_numpy(np.lib.format.open_memmap(file, mode = "w+", dtype = np.uint8, shape = tuple(shape)))
+
+    def build(self):
+        # first pass: serve the loader's batches and keep a uint8 copy
+        n = len(self.loader)
+        data, count = {}, 0
+        for batch in self.loader:
+            B = batch['VIDEO'].size(0)
+            keep = max(0, min(B, n - count)) # the last batches can go past len(loader)
+            for k, v in batch.items():
+                if keep == 0:
+                    break
+                if k not in data:
+                    data[k] = self.storage(k, (n,) + tuple(v.shape[1:]))
+                v = to_uint8(v.detach()) if v.is_floating_point() else v.to(torch.uint8)
+                data[k][count:count + keep] = v[:keep].cpu()
+            count += B
+            yield batch
+        self.data = {k: v[:min(count, n)] for k, v in data.items()}
+        print(f"validation cache: {min(count, n)} samples")
+
+    def __iter__(self):
+        if self.data is None:
+            yield from self.build()
+            return
+        n = self.data['VIDEO'].size(0)
+        for i in range(0, n, self.batch_size):
+            batch = {k: v[i:i + self.batch_size] for k, v in self.data.items()}
+            if 'SEGMENTATION' in batch:
+                batch['SEGMENTATION'] = batch['SEGMENTATION'].long()
+            yield batch
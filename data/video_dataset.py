@@ -4,10 +4,18 @@ import pandas as pd
 import sys
 import os
 import random
-from data.base_dataset import BaseDataset
+from collections import Counter
+from data.base_dataset import BaseDataset, select_frames, cat_collate
+from data.mask_store import MaskStore
+from data.motion_segmentation import motion_segmentation
+from data.clip_cache import ClipCache
+from data.clip_pyramid import ClipPyramid
+from data.video_reader import build_keyframe_index, keyframe_index_file, read_clip
+from data.probe import probe_clips, probe_file, probe_video, report
+from data.bucketing import BucketBatchSampler
+from data.distributed import WeightedEpochSampler
 import torch.nn.functional as F
 import torchvision.transforms as transforms
-from torchvideotransforms import video_transforms, volume_transforms
 
 import torch.hub
 import math
@@ -16,73 +24,6 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
-#https://discuss.pytorch.org/t/is-there-anyway-to-do-gaussian-filtering-for-an-image-2d-3d-in-pytorch/12351/7
-class GaussianSmoothing(nn.Module):
-    """
-    Apply gaussian smoothing on a
-    1d, 2d or 3d tensor. Filtering is performed seperately for each channel
-    in the input using a depthwise convolution.
-    Arguments:
-        channels (int, sequence): Number of channels of the input tensors. Output will
-            have this number of channels as well.
-        kernel_size (int, sequence): Size of the gaussian kernel.
-        sigma (float, sequence): Standard deviation of the gaussian kernel.
-        dim (int, optional): The number of dimensions of the data.
-            Default value is 2 (spatial).
-    """
-    def __init__(self, channels, kernel_size, sigma, dim=2):
-        super(GaussianSmoothing, self).__init__()
-        if isinstance(kernel_size, numbers.Number):
-            kernel_size = [kernel_size] * dim
-        if isinstance(sigma, numbers.Number):
-            sigma = [sigma] * dim
-
-        # The gaussian kernel is the product of the
-        # gaussian function of each dimension.
-        kernel = 1
-        meshgrids = torch.meshgrid(
-            [
-                torch.arange(size, dtype=torch.float32)
-                for size in kernel_size
-            ]
-        )
-        for size, std, mgrid in zip(kernel_size, sigma, meshgrids):
-            mean = (size - 1) / 2
-            kernel *= 1 / (std * math.sqrt(2 * math.pi)) * \
-                      torch.exp(-((mgrid - mean) / (2 * std)) ** 2)
-
-        # Make sure sum of values in gaussian kernel equals 1.
-        kernel = kernel / torch.sum(kernel)
-
-        # Reshape to depthwise convolutional weight
-        kernel = kernel.view(1, 1, *kernel.size())
-        kernel = kernel.repeat(channels, *[1] * (kernel.dim() - 1))
-
-        self.register_buffer('weight', kernel)
-        self.groups = channels
-
-        if dim == 1:
-            self.conv = F.conv1d
-        elif dim == 2:
-            self.conv = F.conv2d
-        elif dim == 3:
-            self.conv = F.conv3d
-        else:
-            raise RuntimeError(
-                'Only 1, 2 and 3 dimensions are supported. Received {}.'.format(dim)
-            )
-
-    def forward(self, input):
-        """
-        Apply gaussian filter to input.
-        Arguments:
-            input (torch.Tensor): Input to apply gaussian filter on.
-        Returns:
-            filtered (torch.Tensor): Filtered output.
-        """
-        input = F.pad(input, (2, 2, 2, 2), mode='reflect')
-        return self.conv(input, weight=self.weight, groups=self.groups)
-
 def deeplab_inference(model, image, raw_image=None, postprocessor=None):
     with torch.no_grad(): 
         _, _, H, W = image.shape
@@ -101,28 +42,24 @@ def deeplab_inference(model, image, raw_image=None, postprocessor=None):
 
     return logits, probs, labelmap  
 
-def motion_segmentation(x, eps = 1e-3, channel_dim = -1, num_offsets = 3, offset_offsets = 3, smooth_kernel = 5, smooth_sigma = 1): 
-    assert len(x.shape) == 4
-    seg = 0
-    for o in range(1,num_offsets+1):
-        o = o * offset_offsets
-        td = x - torch.cat([x[:o,...], x[:-o]]) 
-        td = torch.abs(td)
-        td = torch.sum(td, dim = channel_dim, keepdim = True)
-        motion_seg = torch.sum(td, dim = 0) / x.size(0)
-        motion_seg = motion_seg > eps
-        seg = seg + motion_seg
-    seg = seg>0
-    if smooth_kernel>0: 
-        smoothing = GaussianSmoothing(1, smooth_kernel, smooth_sigma)
-        seg = smoothing(seg.permute(2,0,1).float().unsqueeze(0)).squeeze(0).permute(1,2,0)
-        seg = seg > 1./smooth_kernel
-    return seg.long()
-
+# identifies the rows of a clips file in a clip pyramid
+def clip_keys(df):
+    return [f"{r['file_name']}:{r['start']}:{r['end']}" for _, r in df.iterrows()]
 
 #expected header in info.csv: video_id,file_name,resolution,fps,start,end
 class VideoDataset(BaseDataset): 
 
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--clip_cache', type=str, default=None, help='decode every clip once into memory mapped uint8 shards in this directory and serve samples from there')
+        parser.add_argument('--clip_cache_shard_frames', type=int, default=20000, help='max. number of frames per clip cache shard')
+        parser.add_argument('--clip_pyramid', type=str, default=None, help='read pre-resized frames from the closest level of a pyramid built by misc/build_clip_pyramid.py')
+        parser.add_argument('--clip_windows', action='store_true', help='every non-overlapping max_clip_length window of a clip is a sample (instead of one random window per clip)')
+        parser.add_argument('--balance_videos', action='store_true', help='sample so that every video_id is drawn equally often, regardless of its number of clips/windows')
+        parser.add_argument('--windows_per_decode', type=int, default=1, help='with --clip_windows: decode K consecutive windows at once and put all of them into the batch (batch_size counts windows)')
+        parser.add_argument('--keyframe_index', action='store_true', help='index keyframes of every video once (stored next to the clips file) and seek straight to the sampled window')
+        return parser
+
    #init when not using cyclegan framework
    # def init(self,root, clips_file ="info.csv",max_clip_length = 10.0, fps = 30, max_size = sys.maxsize, ): 
         #torchvision.set_video_backend("video_reader")
@@ -138,21 +75,57 @@ class VideoDataset(BaseDataset):
         self.fps = opt.fps
         self.skip_frames = opt.skip_frames
         self.df = pd.read_csv(os.path.join(self.root,clips_file))
-        self.len = int(min(opt.max_dataset_size, self.df.shape[0]))
         self.nframes = int(opt.fps * opt.max_clip_length // opt.skip_frames)
+        self.probed = opt.probe_clips
+        self.probed_frames = None
+        if self.probed: 
+            # drop clips without a single full window of decodable frames, the rest keeps its number of full windows
+            files = [os.path.join(self.root, f) for f in self.df['file_name']]
+            jobs = [(f, r['start'], r['end']) for f, (_, r) in zip(files, self.df.iterrows())]
+            probes = probe_clips(probe_file(self.root, os.path.splitext(clips_file)[0]), clip_keys(self.df), files, jobs, probe_video, n_workers = opt.probe_workers, rescan = opt.reparse_data)
+            keep = [i for i, p in enumerate(probes) if p['frames'] >= self.nframes * self.skip_frames]
+            report(clips_file, len(self.df), len(keep))
+            self.df = self.df.iloc[keep]
+            self.probed_frames = [probes[i]['frames'] for i in keep]
+        self.len = int(min(opt.max_dataset_size, self.df.shape[0]))
+        self.balance_videos = opt.balance_videos
+        self.windows = None
+        self.clips_per_item = 1
+        if opt.clip_windows: 
+            # (row, first window, number of windows), consecutive windows of a row are grouped for --windows_per_decode
+            self.clips_per_item = max(1, opt.windows_per_decode)
+            self.windows = []
+            for row in range(self.len):
+                clip = self.df.iloc[row]
+                n = max(1, int((clip['end'] - clip['start']) // self.max_clip_length))
+                if self.probed_frames is not None: 
+                    n = min(n, self.probed_frames[row] // (self.nframes * self.skip_frames))
+                self.windows += [(row, w, min(self.clips_per_item, n - w)) for w in range(0, n, self.clips_per_item)]
+            print(f"{len(self.windows)} samples from {self.len} clips")
+        self.length_buckets = opt.length_buckets
+        self.bucket_frame_budget = opt.bucket_frame_budget
         self.resolution = opt.resolution
         print(f"nframes: {self.nframes}")
-        if opt.phase == "train" and not opt.no_augmentation: 
-            self.augmentation = transforms.Compose([
-            #  torchvision.transforms.ColorJitter(brightness=.1, contrast=.1, saturation=.1, hue=.1),
-            # video_transforms.RandomCrop((self.resolution,self.resolution)),
-                video_transforms.RandomHorizontalFlip(),
-                volume_transforms.ClipToTensor(),
-            ])
-        else: 
-            self.augmentation = None
-        self.use_segmentation = opt.use_segmentation or opt.masked_update
+        self.clip_cache = None
+        if opt.clip_cache: 
+            self.clip_cache = ClipCache(opt.clip_cache, self.root, self.df.iloc[:self.len], os.path.join(self.root,clips_file), self.resolution, self.skip_frames, shard_frames = opt.clip_cache_shard_frames, rows = self.df.index[:self.len].tolist() if self.probed else None)
+        self.pyramid = None
+        if opt.clip_pyramid and self.clip_cache is None: 
+            self.pyramid = ClipPyramid(opt.clip_pyramid, self.resolution, clip_keys(self.df.iloc[:self.len]))
+        self.keyframes = None
+        if opt.keyframe_index and self.clip_cache is None and self.pyramid is None: 
+            self.keyframes = build_keyframe_index(self.root, self.df['file_name'].iloc[:self.len].tolist(), keyframe_index_file(self.root, clips_file))
+        self.init_clip_preprocessing(opt)
+        self.use_segmentation = (opt.use_segmentation or opt.masked_update) and not opt.segmentation_on_device
         self.seg_eps = opt.motion_seg_eps
+        self.fixed_start = False # first window of every clip instead of a random one (misc/precompute_masks.py)
+        self.mask_store = None
+        if self.use_segmentation and opt.precomputed_masks: 
+            assert self.clips_per_item == 1, "precomputed masks hold one mask per sample, use --windows_per_decode 1"
+            assert not self.length_buckets, "precomputed masks cover max_clip_length windows, they can't be combined with --length_buckets"
+            self.mask_store = MaskStore(opt, len(self))
+            # masks were computed on the first window of every clip (or on the fixed --clip_windows windows)
+            self.fixed_start = True
         # if self.use_segmentation: 
         #     import warnings
         #     warnings.filterwarnings("ignore", category=UserWarning) 
@@ -168,33 +141,96 @@ class VideoDataset(BaseDataset):
 
 
     def __len__(self): 
-        return self.len
+        return self.len if self.windows is None else len(self.windows)
+
+    def get_sampler(self):
+        if not self.balance_videos: 
+            return None
+        rows = range(self.len) if self.windows is None else [row for row, _, _ in self.windows]
+        video_ids = self.df['video_id'].iloc[list(rows)].tolist()
+        counts = Counter(video_ids)
+        weights = [1.0 / counts[v] for v in video_ids]
+        return WeightedEpochSampler(weights, num_samples = len(weights))
+
+    def get_collate_fn(self):
+        return cat_collate if self.clips_per_item > 1 else None
+
+    def clip_frames(self, row):
+        # frames of a clip after skip_frames
+        if self.probed_frames is not None: 
+            return self.probed_frames[row] // self.skip_frames
+        clip = self.df.iloc[row]
+        return int((clip['end'] - clip['start']) * self.fps) // self.skip_frames
+
+    def get_batch_sampler(self, batch_size, shuffle, indices = None):
+        if not self.length_buckets: 
+            return None
+        assert self.windows is None, "--length_buckets samples whole clips, it can't be combined with --clip_windows"
+        indices = list(range(self.len)) if indices is None else indices
+        budget = self.bucket_frame_budget if self.bucket_frame_budget > 0 else batch_size * self.nframes
+        return BucketBatchSampler(indices, [self.clip_frames(i) for i in indices], self.length_buckets, budget, shuffle = shuffle)
+
+    def load_frames(self, row, window, count, nframes = None):
+        # frames of `count` consecutive windows of nframes (default: --max_clip_length) starting at `window` (None: random start) of clip `row`
+        clip = self.df.iloc[row]
+        nframes = self.nframes if nframes is None else nframes
+        n = nframes * count
+        if self.clip_cache is not None: 
+            # cached frames are already skipped and resized
+            if window is not None: 
+                frames = self.clip_cache.get(row, window * nframes, n)
+            else: 
+                frames = self.clip_cache.get(row, 0, n) if self.fixed_start else self.clip_cache.sample(row, n)
+        elif self.pyramid is not None: 
+            # pyramid levels hold every source frame of the clip
+            num_frames = self.pyramid.num_frames(row)
+            span = n * self.skip_frames
+            if window is not None: 
+                start = window * nframes * self.skip_frames
+            else: 
+                start = 0 if self.fixed_start else random.randint(0, max(num_frames - span, 0))
+            frames = self.pyramid.get(row, select_frames(num_frames, n, self.skip_frames, start))
+            if num_frames - start < span and not self.probed: 
+                print(f"ERROR: id: {row} has {num_frames - start}/{span} frames. File name: {clip['file_name']}")
+            return frames
+        else: 
+            length = self.max_clip_length * n / self.nframes
+            if window is not None: 
+                start = clip['start'] + window * self.max_clip_length
+            else: 
+                start = clip['start'] if self.fixed_start else random.uniform(clip['start'], clip['end'] - length)
+            end = min(start + length, clip['end'])
+            entry = self.keyframes[clip['file_name']] if self.keyframes is not None else None
+            # only every skip_frames-th frame of the window is converted
+            frames = read_clip(os.path.join(self.root,clip['file_name']), entry, start, n, self.skip_frames, end = end)
+        if frames.shape[0] < n: 
+            if not self.probed: # probed clips can only miss a frame or two to timestamp jitter
+                print(f"ERROR: id: {row} has {frames.shape[0]}/{n} frames. File name: {clip['file_name']}")
+            frames = frames[select_frames(frames.shape[0], n)]
+        return frames
 
     def __getitem__(self, index):
+        nframes = None
+        if isinstance(index, tuple): # (index, nframes) from the bucket sampler
+            index, nframes = index
+        if self.windows is not None: 
+            row, window, count = self.windows[index]
+        else: 
+            row, window, count = index, None, 1
+        assert self.mask_store is None or (nframes is None and (window is not None or self.fixed_start)), "precomputed masks need the same windows they were computed on"
+        frames = self.load_frames(row, window, count, nframes)
+        if self.clips_per_item == 1: 
+            return self.preprocess(index, frames, nframes)
+        # several windows from one decode, cat_collate puts all of them into the batch
+        clips = [self.preprocess(index, frames[i*self.nframes:(i+1)*self.nframes]) for i in range(count)]
+        return {k: torch.stack([c[k] for c in clips]) for k in clips[0]}
+
+    def preprocess(self, index, frames, nframes = None):
         out = {}
-        clip = self.df.iloc[index]
-        start = random.uniform(clip['start'], clip['end'] - self.max_clip_length)
-        end = min(start + self.max_clip_length, clip['end'])
-        frames, _, info = torchvision.io.read_video(os.path.join(self.root,clip['file_name']), start, end, pts_unit="sec")
-
-        if frames.shape[0] < self.nframes*self.skip_frames: 
-            print(f"ERROR: id: {index} has {frames.shape[0]}/{self.nframes*self.skip_frames} frames. File name: {clip['file_name']}")
-            missing = self.nframes * self.skip_frames - frames.shape[0]
-            frames = torch.cat([frames, frames[-1,...].repeat(missing, 1, 1, 1)])
-
-        if self.skip_frames>1: 
-            T,C,H,W = frames.shape
-            skipped = torch.zeros(T//self.skip_frames, C,H,W)
-            for i in range(T//self.skip_frames):
-                skipped[i] = frames[i*self.skip_frames]
-            frames = skipped
         first_frame = frames[0]
-        frames = frames[:self.nframes,...].float()
-        frames = F.interpolate(frames.permute(0,3,1,2), size = (self.resolution, self.resolution), mode = "bilinear", align_corners=False).permute(0,2,3,1)
-
-        if self.augmentation: 
-            frames = self.augmentation(frames.numpy()).permute(1,2,3,0) *255
-        out['VIDEO'] = frames
+        out['VIDEO'], flip = self.preprocess_video(frames, nframes or self.nframes)
+        if self.mask_store is not None: 
+            out['SEGMENTATION'] = self.mask_store.get(index, flip)
         # if self.use_segmentation: 
         #     first_frame = frames[0].permute(2,0,1).unsqueeze(0)
         #     logits, probs, labelmap = deeplab_inference(self.deeplab, first_frame)
@@ -204,8 +240,8 @@ class VideoDataset(BaseDataset):
         #     out['SEGMENTATION'] = staticmap.unsqueeze(0)
         #     print(f"found: {[(x, self.label_dict[x]) for x in torch.unique(labelmap).tolist()]}")
         #     #out['SEGMENTATION'] = probs
-        if self.use_segmentation: 
-            out['SEGMENTATION'] = motion_segmentation(frames, eps = self.seg_eps).permute(2,0,1)
+        if self.use_segmentation and self.mask_store is None: 
+            out['SEGMENTATION'] = motion_segmentation(out['VIDEO'].float(), eps = self.seg_eps).permute(2,0,1)
         return out
 
 
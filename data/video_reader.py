@@ -0,0 +1,87 @@
+import os
+import json
+import bisect
+import numpy as np
+import torch
+import av
+from data.distributed import tmp_path
+
+
+def keyframe_index_file(root, clips_file):
+    return os.path.join(root, os.path.splitext(clips_file)[0] + "_keyframes.json")
+
+def scan_keyframes(file_name):
+    # demux only (no decoding) to collect the pts of every keyframe
+    with av.open(file_name) as container:
+        stream = container.streams.video[0]
+        keyframes = [packet.pts for packet in container.demux(stream) if packet.is_keyframe and packet.pts is not None]
+        fps = float(stream.average_rate) if stream.average_rate else 0
+        return {
+            "time_base": float(stream.time_base),
+            "fps": fps,
+            "keyframes": sorted(keyframes),
+        }
+
+def build_keyframe_index(root, file_names, index_file):
+    """
+    Loads the keyframe/pts index stored next to the clips file and (re)scans every file that is
+    missing or has been modified since it was indexed.
+    """
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+    changed = False
+    file_names = sorted(set(file_names))
+    for i, file_name in enumerate(file_names):
+        stat = os.stat(os.path.join(root, file_name))
+        entry = index.get(file_name)
+        if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            continue
+        entry = scan_keyframes(os.path.join(root, file_name))
+        entry["mtime"] = stat.st_mtime
+        entry["size"] = stat.st_size
+        index[file_name] = entry
+        changed = True
+        if i % 100 == 0:
+            print(f"keyframe index: {i+1}/{len(file_names)}")
+    if changed:
+        with open(tmp_path(index_file), "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path(index_file), index_file)
+    return index
+
+def read_clip(file_name, entry, start, nframes, skip_frames = 1, end = None):
+    """
+    Decodes the nframes frames (every skip_frames-th one) following start (in seconds) and only
+    converts those to RGB. With a keyframe index entry the reader seeks straight to the last keyframe
+    before start, otherwise it relies on the demuxer's own seek. Returns T x H x W x C uint8 like
+    torchvision.io.read_video, T < nframes if the video (or end, in seconds) ends early.
+    """
+    frames = []
+    with av.open(file_name) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        time_base = entry["time_base"] if entry is not None else float(stream.time_base)
+        target = int(start / time_base)
+        if entry is not None:
+            keyframes = entry["keyframes"]
+            if len(keyframes) > 0:
+                k = max(bisect.bisect_right(keyframes, target) - 1, 0)
+                container.seek(keyframes[k], stream=stream, backward=True, any_frame=False)
+        elif target > 0:
+            container.seek(target, stream=stream, backward=True, any_frame=False)
+        i = 0
+        for frame in container.decode(stream):
+            if frame.pts is None or frame.pts < target:
+                continue
+            if end is not None and frame.pts * time_base > end:
+                break
+            if i % skip_frames == 0:
+                frames.append(frame.to_ndarray(format="rgb24"))
+                if len(frames) >= nframes:
+                    break
+            i += 1
+    if len(frames) == 0:
+        return torch.zeros((0, 1, 1, 3), dtype = torch.uint8)
+    return torch.from_numpy(np.stack(frames))
@@ -1,15 +1,20 @@
 import torch
 import torchvision
+import numpy as np
 import pandas as pd
 from PIL import Image
 import sys
 import glob
 import os
-import random
-from data.base_dataset import BaseDataset
+from data.base_dataset import BaseDataset, select_frames, frame_sort_key
+from data.mask_store import MaskStore
+from data.motion_segmentation import motion_segmentation
+from data.video_reader import read_clip
+from data.manifest import load_manifest
+from data.clip_pyramid import ClipPyramid
+from data.probe import probe_clips, probe_file, probe_video, probe_frames, report
 import torch.nn.functional as F
 import torchvision.transforms as transforms
-from torchvideotransforms import video_transforms, volume_transforms
 
 import torch.hub
 import math
@@ -18,73 +23,6 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
-#https://discuss.pytorch.org/t/is-there-anyway-to-do-gaussian-filtering-for-an-image-2d-3d-in-pytorch/12351/7
-class GaussianSmoothing(nn.Module):
-    """
-    Apply gaussian smoothing on a
-    1d, 2d or 3d tensor. Filtering is performed seperately for each channel
-    in the input using a depthwise convolution.
-    Arguments:
-        channels (int, sequence): Number of channels of the input tensors. Output will
-            have this number of channels as well.
-        kernel_size (int, sequence): Size of the gaussian kernel.
-        sigma (float, sequence): Standard deviation of the gaussian kernel.
-        dim (int, optional): The number of dimensions of the data.
-            Default value is 2 (spatial).
-    """
-    def __init__(self, channels, kernel_size, sigma, dim=2):
-        super(GaussianSmoothing, self).__init__()
-        if isinstance(kernel_size, numbers.Number):
-            kernel_size = [kernel_size] * dim
-        if isinstance(sigma, numbers.Number):
-            sigma = [sigma] * dim
-
-        # The gaussian kernel is the product of the
-        # gaussian function of each dimension.
-        kernel = 1
-        meshgrids = torch.meshgrid(
-            [
-                torch.arange(size, dtype=torch.float32)
-                for size in kernel_size
-            ]
-        )
-        for size, std, mgrid in zip(kernel_size, sigma, meshgrids):
-            mean = (size - 1) / 2
-            kernel *= 1 / (std * math.sqrt(2 * math.pi)) * \
-                      torch.exp(-((mgrid - mean) / (2 * std)) ** 2)
-
-        # Make sure sum of values in gaussian kernel equals 1.
-        kernel = kernel / torch.sum(kernel)
-
-        # Reshape to depthwise convolutional weight
-        kernel = kernel.view(1, 1, *kernel.size())
-        kernel = kernel.repeat(channels, *[1] * (kernel.dim() - 1))
-
-        self.register_buffer('weight', kernel)
-        self.groups = channels
-
-        if dim == 1:
-            self.conv = F.conv1d
-        elif dim == 2:
-            self.conv = F.conv2d
-        elif dim == 3:
-            self.conv = F.conv3d
-        else:
-            raise RuntimeError(
-                'Only 1, 2 and 3 dimensions are supported. Received {}.'.format(dim)
-            )
-
-    def forward(self, input):
-        """
-        Apply gaussian filter to input.
-        Arguments:
-            input (torch.Tensor): Input to apply gaussian filter on.
-        Returns:
-            filtered (torch.Tensor): Filtered output.
-        """
-        input = F.pad(input, (2, 2, 2, 2), mode='reflect')
-        return self.conv(input, weight=self.weight, groups=self.groups)
-
 def deeplab_inference(model, image, raw_image=None, postprocessor=None):
     with torch.no_grad(): 
         _, _, H, W = image.shape
@@ -103,28 +41,30 @@ def deeplab_inference(model, image, raw_image=None, postprocessor=None):
 
     return logits, probs, labelmap  
 
-def motion_segmentation(x, eps = 1e-3, channel_dim = -1, num_offsets = 3, offset_offsets = 3, smooth_kernel = 5, smooth_sigma = 1): 
-    assert len(x.shape) == 4
-    seg = 0
-    for o in range(1,num_offsets+1):
-        o = o * offset_offsets
-        td = x - torch.cat([x[:o,...], x[:-o]]) 
-        td = torch.abs(td)
-        td = torch.sum(td, dim = channel_dim, keepdim = True)
-        motion_seg = torch.sum(td, dim = 0) / x.size(0)
-        motion_seg = motion_seg > eps
-        seg = seg + motion_seg
-    seg = seg>0
-    if smooth_kernel>0: 
-        smoothing = GaussianSmoothing(1, smooth_kernel, smooth_sigma)
-        seg = smoothing(seg.permute(2,0,1).float().unsqueeze(0)).squeeze(0).permute(1,2,0)
-        seg = seg > 1./smooth_kernel
-    return seg.long()
-
+def scan_samples(root):
+    # mp4 files in root or sequence dirs (+ their sorted frames) in root/*/*/, paths relative to root
+    samples = [[os.path.relpath(s, root), []] for s in sorted(glob.glob(os.path.join(root,"*.mp4")))]
+    dirs = ["."]
+    if len(samples) > 0: 
+        return [True, samples], dirs
+    #mb they are hidden in some sub-dir
+    for dir in sorted(glob.glob(os.path.join(root,"*/"))): 
+        dirs.append(os.path.relpath(dir, root))
+        for sub_dir in sorted(glob.glob(os.path.join(dir,"*/"))): 
+            dirs.append(os.path.relpath(sub_dir, root))
+            frames = [os.path.basename(f) for f in glob.glob(os.path.join(sub_dir,"*.png")) + glob.glob(os.path.join(sub_dir,"*.jpg"))]
+            if len(glob.glob(os.path.join(sub_dir,"*"))) >= 15: # valid_seq
+                samples.append([os.path.relpath(sub_dir, root), sorted(frames, key = frame_sort_key)])
+    return [False, samples], dirs
 
 #expected header in info.csv: video_id,file_name,resolution,fps,start,end
 class VideofolderDataset(BaseDataset): 
 
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--clip_pyramid', type=str, default=None, help='read pre-resized frames from the closest level of a pyramid built by misc/build_clip_pyramid.py')
+        return parser
+
    #init when not using cyclegan framework
    # def init(self,root, clips_file ="info.csv",max_clip_length = 10.0, fps = 30, max_size = sys.maxsize, ): 
         #torchvision.set_video_backend("video_reader")
@@ -136,35 +76,33 @@ class VideofolderDataset(BaseDataset):
         self.fps = opt.fps
         self.skip_frames = opt.skip_frames
         self.nframes = int(opt.fps * opt.max_clip_length // opt.skip_frames)
-        self.samples = glob.glob(os.path.join(self.root,"*.mp4"))
-        self.as_vids = True
-        if len(self.samples) == 0: #mb they are hidden in some sub-dir
-            dirs = glob.glob(os.path.join(self.root,"*"))
-            
-            for dir in dirs: 
-                self.samples += [os.path.join(dir, sub_dir) for sub_dir in glob.glob(os.path.join(dir,"*/"))]
-            self.as_vids = False
-
-            def valid_seq(dir): 
-                return len(glob.glob(dir +"/*")) >= 15
-
-            self.samples = [s for s in self.samples if valid_seq(s)]
+        self.as_vids, self.samples = load_manifest(self.root, "videofolder", scan_samples, rescan = opt.reparse_data)
+        keys = [s for s, _ in self.samples]
+        self.samples = [(os.path.join(self.root, s), [os.path.join(self.root, s, f) for f in frames]) for s, frames in self.samples]
+        self.probed = opt.probe_clips
+        if self.probed: 
+            # drop samples with less than nframes*skip_frames decodable frames, broken images are removed from sequences
+            if self.as_vids: 
+                probes = probe_clips(probe_file(self.root, "videofolder"), keys, [s for s, _ in self.samples], [(s, 0, 3) for s, _ in self.samples], probe_video, n_workers = opt.probe_workers, rescan = opt.reparse_data)
+            else: 
+                probes = probe_clips(probe_file(self.root, "videofolder"), keys, [s for s, _ in self.samples], [(frames,) for _, frames in self.samples], probe_frames, n_workers = opt.probe_workers, rescan = opt.reparse_data)
+                self.samples = [(s, [frames[i] for i in p['valid']]) for (s, frames), p in zip(self.samples, probes)]
+            keep = [i for i, p in enumerate(probes) if p['frames'] >= self.nframes*self.skip_frames]
+            report(self.root, len(self.samples), len(keep))
+            self.samples = [self.samples[i] for i in keep]
+            keys = [keys[i] for i in keep]
 
       #  print(self.root, dirs, self.samples)
         self.len = int(min(opt.max_dataset_size, len(self.samples)))
         self.resolution = opt.resolution
         print(f"nframes: {self.nframes}")
-        if opt.phase == "train" and not opt.no_augmentation: 
-            self.augmentation = transforms.Compose([
-            #  torchvision.transforms.ColorJitter(brightness=.1, contrast=.1, saturation=.1, hue=.1),
-            # video_transforms.RandomCrop((self.resolution,self.resolution)),
-                video_transforms.RandomHorizontalFlip(),
-                volume_transforms.ClipToTensor(),
-            ])
-        else: 
-            self.augmentation = None
-        self.use_segmentation = opt.use_segmentation or opt.masked_update
+        self.pyramid = ClipPyramid(opt.clip_pyramid, self.resolution, keys[:self.len]) if opt.clip_pyramid else None
+        self.init_clip_preprocessing(opt)
+        self.use_segmentation = (opt.use_segmentation or opt.masked_update) and not opt.segmentation_on_device
         self.seg_eps = opt.motion_seg_eps
+        self.mask_store = None
+        if self.use_segmentation and opt.precomputed_masks: 
+            self.mask_store = MaskStore(opt, self.len)
 
     def __len__(self): 
         return self.len
@@ -172,34 +110,30 @@ class VideofolderDataset(BaseDataset):
     def __getitem__(self, index):
         with torch.no_grad(): 
             out = {}
-            s = self.samples[index]
-            if self.as_vids: 
-                frames, _, info = torchvision.io.read_video(s,start_pts=0, end_pts=3, pts_unit="sec")
-
+            s, frame_files = self.samples[index]
+            if self.pyramid is not None: 
+                n = self.pyramid.num_frames(index)
+                if n < self.nframes*self.skip_frames and not self.probed: 
+                    print(f"ERROR: id: {index} has {n}/{self.nframes*self.skip_frames} frames. File name: {s}")
+                frames = self.pyramid.get(index, select_frames(n, self.nframes, self.skip_frames))
+            elif self.as_vids: 
+                # only every skip_frames-th frame of the first nframes*skip_frames is converted
+                frames = read_clip(s, None, 0, self.nframes, self.skip_frames, end = 3)
+                if frames.shape[0] < self.nframes: 
+                    if not self.probed: 
+                        print(f"ERROR: id: {index} has {frames.shape[0]*self.skip_frames}/{self.nframes*self.skip_frames} frames. File name: {s}")
+                    frames = frames[select_frames(frames.shape[0], self.nframes)]
             else: 
-                frame_list = [transforms.ToTensor()(Image.open(frame).convert("RGB")) for frame in  glob.glob(os.path.join(s,"*.png"))]
-                frame_list += [transforms.ToTensor()(Image.open(frame).convert("RGB")) for frame in  glob.glob(os.path.join(s,"*.jpg"))]
-
-                frames = torch.stack(frame_list, dim = 0).permute(0,2,3,1)*255
-
-            if frames.shape[0] < self.nframes*self.skip_frames: 
-                print(f"ERROR: id: {index} has {frames.shape[0]}/{self.nframes*self.skip_frames} frames. File name: {s}")
-                missing = self.nframes * self.skip_frames - frames.shape[0]
-                frames = torch.cat([frames, frames[-1,...].repeat(missing, 1, 1, 1)])
-
-            if self.skip_frames>1: 
-                T,C,H,W = frames.shape
-                skipped = torch.zeros(T//self.skip_frames, C,H,W)
-                for i in range(T//self.skip_frames):
-                    skipped[i] = frames[i*self.skip_frames]
-                frames = skipped
-            first_frame = frames[0]
-            frames = frames[:self.nframes,...].float()
-            frames = F.interpolate(frames.permute(0,3,1,2), size = (self.resolution, self.resolution), mode = "bilinear", align_corners=False).permute(0,2,3,1)
+                if len(frame_files) < self.nframes*self.skip_frames: 
+                    print(f"ERROR: id: {index} has {len(frame_files)}/{self.nframes*self.skip_frames} frames. File name: {s}")
+                # only open the frames that survive skip_frames
+                frame_list = [torch.from_numpy(np.asarray(Image.open(frame_files[i]).convert("RGB"))) for i in select_frames(len(frame_files), self.nframes, self.skip_frames).tolist()]
+                frames = torch.stack(frame_list, dim = 0)
 
-            if self.augmentation: 
-                frames = self.augmentation(frames.numpy()).permute(1,2,3,0) *255
-            out['VIDEO'] = frames
+            first_frame = frames[0]
+            out['VIDEO'], flip = self.preprocess_video(frames, self.nframes)
+            if self.mask_store is not None: 
+                out['SEGMENTATION'] = self.mask_store.get(index, flip)
             # if self.use_segmentation: 
             #     first_frame = frames[0].permute(2,0,1).unsqueeze(0)
             #     logits, probs, labelmap = deeplab_inference(self.deeplab, first_frame)
@@ -209,8 +143,8 @@ class VideofolderDataset(BaseDataset):
             #     out['SEGMENTATION'] = staticmap.unsqueeze(0)
             #     print(f"found: {[(x, self.label_dict[x]) for x in torch.unique(labelmap).tolist()]}")
             #     #out['SEGMENTATION'] = probs
-            if self.use_segmentation: 
-                out['SEGMENTATION'] = motion_segmentation(frames, eps = self.seg_eps).permute(2,0,1)
+            if self.use_segmentation and self.mask_store is None: 
+                out['SEGMENTATION'] = motion_segmentation(out['VIDEO'].float(), eps = self.seg_eps).permute(2,0,1)
             return out
 
 
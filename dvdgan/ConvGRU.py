@@ -2,11 +2,23 @@ import torch
 import torch.nn as nn
 from torch.nn import init
 from trajgru.trajgru import TrajGRU
+from dvdgan.HiddenState import zero_state
 import numpy as np
 
+def fuse_gates(weights, biases, input_size):
+    # [reset, update, out] convolutions on cat([x, state]) -> parameters of the fused ConvGRUCell
+    return {
+        "conv_x.weight": torch.cat([w[:, :input_size] for w in weights]),
+        "conv_x.bias": torch.cat(biases),
+        "conv_h_gates.weight": torch.cat([w[:, input_size:] for w in weights[:2]]),
+        "conv_h_out.weight": weights[2][:, input_size:],
+    }
+
 class ConvGRUCell(nn.Module):
     """
     Generate a convolutional GRU cell
+    gates are fused: one convolution of the input for all three gates (can be computed for a whole sequence
+    up front, see input_projection) and one convolution of the state for reset + update
     """
 
     def __init__(self, input_size, hidden_size, kernel_size, activation=torch.sigmoid):
@@ -15,42 +27,54 @@ class ConvGRUCell(nn.Module):
         padding = kernel_size // 2
         self.input_size = input_size
         self.hidden_size = hidden_size
-        self.reset_gate = nn.Conv2d(input_size + hidden_size, hidden_size, kernel_size, padding=padding)
-        self.update_gate = nn.Conv2d(input_size + hidden_size, hidden_size, kernel_size, padding=padding)
-        self.out_gate = nn.Conv2d(input_size + hidden_size, hidden_size, kernel_size, padding=padding)
+        # [reset, update, out] x input (+ biases), [reset, update] x state, out x (reset * state)
+        self.conv_x = nn.Conv2d(input_size, 3 * hidden_size, kernel_size, padding=padding)
+        self.conv_h_gates = nn.Conv2d(hidden_size, 2 * hidden_size, kernel_size, padding=padding, bias=False)
+        self.conv_h_out = nn.Conv2d(hidden_size, hidden_size, kernel_size, padding=padding, bias=False)
         self.activation = activation
-
-        init.orthogonal_(self.reset_gate.weight)
-        init.orthogonal_(self.update_gate.weight)
-        init.orthogonal_(self.out_gate.weight)
-        init.constant_(self.reset_gate.bias, 0.)
-        init.constant_(self.update_gate.bias, 0.)
-        init.constant_(self.out_gate.bias, 0.)
-
-
-    def forward(self, x, prev_state=None):
+        self.init_gates(init.orthogonal_)
+
+    def init_gates(self, init_fn):
+        # every gate is initialized like the former separate (input + hidden) -> hidden convolution, in that shape,
+        # so orthogonality and fan based scales match it (also used by networks.init_weights). biases are zero
+        k = self.conv_x.kernel_size
+        weights = [init_fn(torch.empty(self.hidden_size, self.input_size + self.hidden_size, *k)) for _ in range(3)]
+        biases = [torch.zeros(self.hidden_size) for _ in range(3)]
+        self.load_state_dict(fuse_gates(weights, biases, self.input_size))
+
+    def gate_weights(self):
+        # inverse of fuse_gates: [reset, update, out] weights in the (input + hidden) layout
+        x = self.conv_x.weight.chunk(3, dim=0)
+        h = list(self.conv_h_gates.weight.chunk(2, dim=0)) + [self.conv_h_out.weight]
+        return [torch.cat([wx, wh], dim=1) for wx, wh in zip(x, h)]
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        # checkpoints with separate reset_gate/update_gate/out_gate convolutions
+        if prefix + "reset_gate.weight" in state_dict:
+            gates = ["reset_gate", "update_gate", "out_gate"]
+            weights = [state_dict.pop(f"{prefix}{g}.weight") for g in gates]
+            biases = [state_dict.pop(f"{prefix}{g}.bias") for g in gates]
+            state_dict.update({prefix + k: v for k, v in fuse_gates(weights, biases, self.input_size).items()})
+        super()._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs)
+
+    def input_projection(self, x):
+        # input part of all gates, x can hold all timesteps at once: (BT) x C x H x W -> (BT) x 3*hidden x H x W
+        return self.conv_x(x)
+
+    def forward(self, x, prev_state=None, projected=False):
+        # projected: x is input_projection(x) of this timestep
 
         if prev_state is None:
-
-            # get batch and spatial sizes
-            batch_size = x.data.size()[0]
-            spatial_size = x.data.size()[2:]
-
-            # generate empty prev_state, if None is provided
-            state_size = [batch_size, self.hidden_size] + list(spatial_size)
-            # prev_state = torch.zeros(state_size)
-
-            if torch.cuda.is_available():
-                prev_state = torch.zeros(state_size).cuda()
-            else:
-                prev_state = torch.zeros(state_size)
+            # zeros on the input's device and dtype, shared by all calls with the same shape
+            prev_state = zero_state((x.size(0), self.hidden_size) + x.size()[2:], x)
 
         # data size is [batch, channel, height, width]
-        stacked_inputs = torch.cat([x, prev_state], dim=1)
+        x_reset, x_update, x_out = (x if projected else self.conv_x(x)).chunk(3, dim=1)
+        h_reset, h_update = self.conv_h_gates(prev_state).chunk(2, dim=1)
 
-        update = self.activation(self.update_gate(stacked_inputs))
-        reset = self.activation(self.reset_gate(stacked_inputs))
-        out_inputs = torch.tanh(self.out_gate(torch.cat([x, prev_state * reset], dim=1)))
+        update = self.activation(x_update + h_update)
+        reset = self.activation(x_reset + h_reset)
+        out_inputs = torch.tanh(x_out + self.conv_h_out(prev_state * reset))
         new_state = prev_state * (1 - update) + out_inputs * update
 
         return new_state
@@ -146,6 +170,49 @@ class ConvGRU(nn.Module):
         # retain tensors in list to allow different hidden sizes
         return output if ret_list else output[-1]
 
+    def forward_sequence(self, x_seq, h0=None):
+        '''
+        Unrolls the whole sequence, layer by layer: the input part of every ConvGRUCell is one convolution over
+        all timesteps (a single one if x_seq is expanded over time) and only the current state of a layer is kept.
+        Parameters
+        ----------
+        x_seq : 5D input tensor. (batch, time, channels, height, width).
+        h0 : initial hidden state(s) like in forward, missing layers start from zeros.
+        Returns
+        -------
+        output : 5D hidden states of the last layer. (batch, time, channels, height, width).
+        '''
+
+        B, T = x_seq.size()[:2]
+        if h0 is None:
+            hidden = [None] * self.n_layers
+        elif type(h0) != list:
+            hidden = [h0]
+        else:
+            hidden = list(h0)
+        hidden += [None] * (self.n_layers - len(hidden))
+
+        input_ = x_seq
+        for cell, h in zip(self.cells, hidden):
+            projected = isinstance(cell, ConvGRUCell)
+            if projected:
+                if input_.stride(1) == 0: # same input at every step
+                    x = cell.input_projection(input_[:, 0]).unsqueeze(1).expand(B, T, -1, -1, -1)
+                else:
+                    x = cell.input_projection(input_.reshape(B * T, *input_.size()[2:]))
+                    x = x.view(B, T, *x.size()[1:])
+            else:
+                x = input_
+            output = None
+            for t in range(T):
+                h = cell(x[:, t], h, projected=True) if projected else cell(x[:, t], h)
+                if output is None:
+                    output = h.new_empty((B, T) + h.size()[1:])
+                output[:, t] = h
+            input_ = output
+
+        return input_
+
 
 if __name__ == "__main__":
 
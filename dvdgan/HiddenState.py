@@ -0,0 +1,38 @@
+import torch
+from collections import OrderedDict
+
+
+class ZeroStateCache():
+    """
+    Zero initial states for recurrent cells, created directly on the device and with the dtype of the input and
+    reused by every call with the same (shape, device, dtype). The states never require grad and are created
+    outside of autograd, so inference under torch.no_grad doesn't build a graph for them.
+    Cells must not modify them in place. Only the max_entries most recently used states are kept, so runs with
+    changing shapes (length buckets, validation at another resolution) don't accumulate them.
+    """
+    def __init__(self, max_entries = 16):
+        self.states = OrderedDict()
+        self.max_entries = max_entries
+
+    def get(self, shape, like):
+        key = (tuple(shape), like.device, like.dtype)
+        state = self.states.get(key)
+        if state is None:
+            with torch.no_grad():
+                state = torch.zeros(key[0], device = like.device, dtype = like.dtype)
+            self.states[key] = state
+            if len(self.states) > self.max_entries:
+                self.states.popitem(last = False)
+        else:
+            self.states.move_to_end(key)
+        return state
+
+    def clear(self):
+        self.states = OrderedDict()
+
+
+zero_states = ZeroStateCache()
+
+# zero state of the given shape on like's device, with like's dtype
+def zero_state(shape, like):
+    return zero_states.get(shape, like)
@@ -12,6 +12,10 @@ class SpectralNorm(nn.Module):
         self.module = module
         self.name = name
         self.power_iterations = power_iterations
+        self.frozen = False
+        # weight_bar (version, storage, device, dtype) that u, v / the no-grad weight were computed for
+        self._uv_key = None
+        self._weight_key = None
         if not self._made_params():
             self._make_params()
 
@@ -21,13 +25,51 @@ class SpectralNorm(nn.Module):
         w = getattr(self.module, self.name + "_bar")
 
         height = w.data.shape[0]
-        for _ in range(self.power_iterations):
-            v.data = l2normalize(torch.mv(torch.t(w.view(height,-1).data), u.data))
-            u.data = l2normalize(torch.mv(w.view(height,-1).data, v.data))
-
-        # sigma = torch.dot(u.data, torch.mv(w.view(height,-1).data, v.data))
-        sigma = u.dot(w.view(height, -1).mv(v))
-        setattr(self.module, self.name, w / sigma.expand_as(w))
+        # optimizer steps and load_state_dict bump the version, .to()/.half() and .data swaps change the storage.
+        # DataParallel replicas (more than one gpu) get new storage on every forward and always recompute
+        key = (w._version, w.data_ptr(), w.device, w.dtype)
+        if key != self._uv_key:
+            for _ in range(self.power_iterations):
+                v.data = l2normalize(torch.mv(torch.t(w.view(height,-1).data), u.data))
+                u.data = l2normalize(torch.mv(w.view(height,-1).data, v.data))
+            self._uv_key = key
+
+        # with grad every forward needs the division in its own graph (one shared graph would be backpropagated
+        # twice with --parallell_batch_size accumulation), without grad the normalized weight is reused
+        if torch.is_grad_enabled() or key != self._weight_key:
+            # sigma = torch.dot(u.data, torch.mv(w.view(height,-1).data, v.data))
+            sigma = u.dot(w.view(height, -1).mv(v))
+            setattr(self.module, self.name, w / sigma.expand_as(w))
+            self._weight_key = None if torch.is_grad_enabled() else key
+
+    def _apply(self, fn):
+        # the cached weight and keys refer to the old storage
+        self._uv_key = None
+        self._weight_key = None
+        if not self.frozen and self.name in self.module.__dict__:
+            delattr(self.module, self.name)
+        return super()._apply(fn)
+
+    def freeze(self):
+        # inference / export: normalized weight computed once and stored as a non-persistent buffer (moves with
+        # .to(), stays out of state_dict, so checkpoints are unchanged), forward doesn't touch u, v or weight_bar
+        # anymore. freeze after loading the weights, unfreeze before training again
+        if self.frozen:
+            return
+        with torch.no_grad():
+            self._update_u_v()
+            w = getattr(self.module, self.name).detach().clone()
+        delattr(self.module, self.name)
+        self.module.register_buffer(self.name, w, persistent=False)
+        self.frozen = True
+
+    def unfreeze(self):
+        if not self.frozen:
+            return
+        del self.module._buffers[self.name]
+        self.module._non_persistent_buffers_set.discard(self.name)
+        self._weight_key = None
+        self.frozen = False
 
     def _made_params(self):
         try:
@@ -59,9 +101,17 @@ class SpectralNorm(nn.Module):
 
 
     def forward(self, *args):
-        self._update_u_v()
+        if not self.frozen:
+            self._update_u_v()
         return self.module.forward(*args)
 
+# freezes every SpectralNorm in net (see SpectralNorm.freeze), returns how many
+def freeze_spectral_norm(net):
+    norms = [m for m in net.modules() if isinstance(m, SpectralNorm)]
+    for m in norms:
+        m.freeze()
+    return len(norms)
+
 class ConditionalNorm(nn.Module):
 
     def __init__(self, in_channel, n_condition=96):
@@ -0,0 +1,65 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.base_dataset import preprocess_clip, to_uint8
+
+# time and peak memory per sample of the dataset preprocessing, before and after data.base_dataset.preprocess_clip
+# usage: python misc/benchmark_preprocess.py --frames 48 --size 256 --resolution 64 --flip
+
+def legacy_preprocess(frames, nframes, resolution, flip):
+    # the chain the datasets used before: float copy, resize, RandomHorizontalFlip + ClipToTensor on numpy (C x T x H x W, /255), *255, uint8
+    frames = frames[:nframes,...].float()
+    frames = F.interpolate(frames.permute(0,3,1,2), size = (resolution, resolution), mode = "bilinear", align_corners=False).permute(0,2,3,1)
+    clip = [np.fliplr(f) if flip else f for f in frames.numpy()]
+    clip = torch.from_numpy(np.stack(clip).transpose(3, 0, 1, 2).copy()).float().div(255)
+    frames = clip.permute(1,2,3,0) * 255
+    return to_uint8(frames)
+
+def fused_preprocess(frames, nframes, resolution, flip):
+    return preprocess_clip(frames, nframes, resolution, flip = flip)
+
+def run(args, name, queue):
+    # one process per variant, ru_maxrss is the peak of the whole process
+    torch.set_num_threads(1)
+    preprocess = {"legacy": legacy_preprocess, "fused": fused_preprocess}[name]
+    frames = torch.randint(0, 256, (args.frames, args.size, args.size, 3), dtype = torch.uint8)
+    # freed memory is reused by later samples, so the peak is taken from the first one
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out = preprocess(frames, args.frames, args.resolution, args.flip)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    t = time.perf_counter()
+    for _ in range(args.iters):
+        out = preprocess(frames, args.frames, args.resolution, args.flip)
+    t = (time.perf_counter() - t) / args.iters
+    queue.put((name, t, peak, out))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per sample preprocessing")
+    parser.add_argument("--frames", type=int, default=48, help="frames per clip")
+    parser.add_argument("--size", type=int, default=256, help="size of the decoded frames")
+    parser.add_argument("--resolution", type=int, default=64, help="training resolution")
+    parser.add_argument("--flip", action="store_true", help="flip every clip (worst case of the random flip)")
+    parser.add_argument("--iters", type=int, default=50, help="samples per variant")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    outputs = {}
+    print(f"clip: {args.frames} x {args.size} x {args.size} x 3 uint8 -> {args.resolution}, flip: {args.flip}")
+    for name in ["legacy", "fused"]:
+        p = ctx.Process(target = run, args = (args, name, queue))
+        p.start()
+        name, t, peak, out = queue.get()
+        p.join()
+        outputs[name] = out
+        print(f"{name:>7}: {t * 1000:.2f} ms/sample, peak memory +{peak / 1024:.1f} MB")
+    diff = (outputs["legacy"].int() - outputs["fused"].int()).abs().max().item()
+    print(f"max. difference: {diff}")
@@ -0,0 +1,90 @@
+import argparse
+import math
+import os
+import sys
+import time
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import trajgru.trajgru as trajgru
+from trajgru.trajgru import TrajGRU
+from models.dvdgan_model import DvdConditionalGenerator, DvdStyle2
+
+batched_wrap_all = trajgru.wrap_all
+
+# time per TrajGRU step and per generator forward (trajgru / style2traj) with the old per-flow warping and the
+# batched one with a cached grid
+# usage: python misc/benchmark_trajgru.py --resolution 64 --batch_size 4 --nframes 16
+
+def legacy_wrap(input, flow):
+    # the warp before the grid cache: new meshgrid for every flow
+    B, C, H, W = input.size()
+    xx = torch.arange(0, W).view(1, -1).repeat(H, 1).to(input.device)
+    yy = torch.arange(0, H).view(-1, 1).repeat(1, W).to(input.device)
+    xx = xx.view(1, 1, H, W).repeat(B, 1, 1, 1)
+    yy = yy.view(1, 1, H, W).repeat(B, 1, 1, 1)
+    grid = torch.cat((xx, yy), 1).float()
+    vgrid = grid + flow
+    vgrid[:, 0, :, :] = 2.0 * vgrid[:, 0, :, :].clone() / max(W - 1, 1) - 1.0
+    vgrid[:, 1, :, :] = 2.0 * vgrid[:, 1, :, :].clone() / max(H - 1, 1) - 1.0
+    vgrid = vgrid.permute(0, 2, 3, 1)
+    return torch.nn.functional.grid_sample(input, vgrid, align_corners=True)
+
+def legacy_wrap_all(input, flows):
+    # one grid_sample per flow + cat
+    return torch.cat([legacy_wrap(input, flow) for flow in torch.split(flows, 2, dim=1)], dim=1)
+
+def timeit(f, iters, device):
+    f() # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    t = time.perf_counter()
+    for _ in range(iters):
+        f()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - t) / iters
+
+def compare(name, f, iters, device):
+    # same inputs and weights, only the warp differs
+    times, outputs = {}, {}
+    for variant, wrap_all in [("legacy", legacy_wrap_all), ("batched", batched_wrap_all)]:
+        trajgru.wrap_all = wrap_all
+        torch.manual_seed(0)
+        times[variant] = timeit(f, iters, device)
+        torch.manual_seed(0)
+        outputs[variant] = f()
+    trajgru.wrap_all = batched_wrap_all
+    diff = (outputs["legacy"] - outputs["batched"]).abs().max().item()
+    print(f"{name:>12}: legacy {times['legacy'] * 1000:.2f} ms, batched {times['batched'] * 1000:.2f} ms, speedup {times['legacy'] / times['batched']:.2f}x, max. difference {diff:.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TrajGRU warping")
+    parser.add_argument("--resolution", type=int, default=64, help="frame resolution of the generators")
+    parser.add_argument("--batch_size", type=int, default=4, help="batch size")
+    parser.add_argument("--nframes", type=int, default=16, help="frames per generated clip")
+    parser.add_argument("--ch", type=int, default=8, help="generator channel multiplier")
+    parser.add_argument("--hidden", type=int, default=64, help="hidden channels of the single cell")
+    parser.add_argument("--iters", type=int, default=20, help="timed runs per variant")
+    parser.add_argument("--cpu", action="store_true", help="run on the cpu even if cuda is available")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.cpu else "cpu")
+    print(f"device: {device}, batch: {args.batch_size}, resolution: {args.resolution}, frames: {args.nframes}")
+
+    with torch.no_grad():
+        # one step of a single cell at the size of the finest generator level
+        cell = TrajGRU(args.hidden, args.hidden).to(device)
+        x = torch.randn(args.batch_size, args.hidden, args.resolution // 2, args.resolution // 2, device=device)
+        h = torch.randn(args.batch_size, args.hidden, args.resolution // 2, args.resolution // 2, device=device)
+        compare("cell step", lambda: cell(x, h), args.iters, device)
+
+        # defaults of the dvdgan model options (max_fp 5, start_fp 3)
+        log_res = int(math.log(args.resolution, 2))
+        fp_depth = min(5, log_res - 3)
+        latent_dim = 2 ** (log_res - fp_depth)
+        frame = torch.rand(args.batch_size, 3, args.resolution, args.resolution, device=device)
+        netG = DvdConditionalGenerator(nframes=args.nframes, ch=args.ch, latent_dim=latent_dim, noise=True, trajgru=True).to(device).eval()
+        compare("trajgru", lambda: netG(frame), max(1, args.iters // 4), device)
+        netG = DvdStyle2(nframes=args.nframes, depth=fp_depth, ch=args.ch, latent_dim=latent_dim, trajgru=True).to(device).eval()
+        compare("style2traj", lambda: netG(frame), max(1, args.iters // 4), device)
@@ -0,0 +1,60 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import numpy as np
+import pandas as pd
+import torch
+import torchvision
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.clip_pyramid import build_pyramid, resize_multiple
+from data.manifest import load_manifest
+from data.video_dataset import clip_keys
+from data.videofolder_dataset import scan_samples
+
+# stores every clip of a video/videofolder dataset at several resolutions for --clip_pyramid
+# usage: python misc/build_clip_pyramid.py video <dataroot> <out> --clips_file train_info.csv --sizes 64,128,256
+#        python misc/build_clip_pyramid.py videofolder <dataroot>/train <out> --sizes 64,128,256
+
+def load_video(args):
+    file, start, end, sizes = args
+    frames, _, _ = torchvision.io.read_video(file, start, end, pts_unit="sec")
+    return resize_multiple(frames, sizes)
+
+def load_frames(args):
+    files, sizes = args
+    frames = torch.stack([torch.from_numpy(np.asarray(Image.open(f).convert("RGB"))) for f in files], dim = 0)
+    return resize_multiple(frames, sizes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a multi-resolution clip pyramid")
+    parser.add_argument("dataset_mode", type=str, choices=["video", "videofolder"], help="layout of the dataset")
+    parser.add_argument("path", type=str, help="dataroot (video) or the phase directory (videofolder)")
+    parser.add_argument("out", type=str, help="output directory")
+    parser.add_argument("--clips_file", type=str, default="info.csv", help="clips file of a video dataset")
+    parser.add_argument("--sizes", type=str, default="64,128,256", help="resolutions of the pyramid levels")
+    parser.add_argument("--n_worker", type=int, default=8, help="number of decoding workers")
+    parser.add_argument("--shard_frames", type=int, default=20000, help="max. number of frames per shard")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    if args.dataset_mode == "video":
+        df = pd.read_csv(os.path.join(args.path, args.clips_file))
+        keys = clip_keys(df)
+        jobs = [(os.path.join(args.path, r['file_name']), r['start'], r['end'], sizes) for _, r in df.iterrows()]
+        load = load_video
+    else:
+        as_vids, samples = load_manifest(args.path, "videofolder", scan_samples)
+        keys = [s for s, _ in samples]
+        if as_vids:
+            jobs = [(os.path.join(args.path, s), 0, None, sizes) for s, _ in samples]
+            load = load_video
+        else:
+            jobs = [([os.path.join(args.path, s, f) for f in frames], sizes) for s, frames in samples]
+            load = load_frames
+
+    print(f"{len(keys)} clips, sizes: {sizes}")
+    with multiprocessing.Pool(args.n_worker) as pool:
+        build_pyramid(args.out, keys, pool.imap(load, jobs), sizes = sizes, shard_frames = args.shard_frames)
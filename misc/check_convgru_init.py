@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dvdgan.ConvGRU import ConvGRUCell
+from models.networks import init_weights
+
+# compares the gate weights of the fused ConvGRUCell after networks.init_weights with the cell before the fusion
+# (separate, orthogonally initialized reset/update/out convolutions on cat([x, state])): std and singular values
+# per gate
+# usage: python misc/check_convgru_init.py --init_type orthogonal --input_size 64 --hidden_size 64
+
+class LegacyConvGRUCell(nn.Module):
+    def __init__(self, input_size, hidden_size, kernel_size):
+        super().__init__()
+        padding = kernel_size // 2
+        self.reset_gate = nn.Conv2d(input_size + hidden_size, hidden_size, kernel_size, padding=padding)
+        self.update_gate = nn.Conv2d(input_size + hidden_size, hidden_size, kernel_size, padding=padding)
+        self.out_gate = nn.Conv2d(input_size + hidden_size, hidden_size, kernel_size, padding=padding)
+        for gate in [self.reset_gate, self.update_gate, self.out_gate]:
+            nn.init.orthogonal_(gate.weight)
+            nn.init.constant_(gate.bias, 0.)
+
+    def gate_weights(self):
+        return [self.reset_gate.weight, self.update_gate.weight, self.out_gate.weight]
+
+def stats(weights):
+    # per gate: std, largest and smallest singular value of the gate as a matrix (hidden x (input + hidden) * k * k)
+    out = []
+    for w in weights:
+        s = torch.svd(w.detach().reshape(w.size(0), -1))[1]
+        out.append((w.std().item(), s.max().item(), s.min().item()))
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ConvGRUCell init statistics with the unfused cell")
+    parser.add_argument("--init_type", type=str, default="orthogonal", help="normal | xavier | kaiming | orthogonal | none")
+    parser.add_argument("--init_gain", type=float, default=0.02, help="gain of networks.init_weights")
+    parser.add_argument("--input_size", type=int, default=64, help="input channels")
+    parser.add_argument("--hidden_size", type=int, default=64, help="hidden channels")
+    parser.add_argument("--kernel_size", type=int, default=3, help="gate kernel size")
+    parser.add_argument("--runs", type=int, default=5, help="cells per variant, statistics are averaged")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="max. relative difference")
+    args = parser.parse_args()
+
+    results = {}
+    for name, cell in [("legacy", LegacyConvGRUCell), ("fused", ConvGRUCell)]:
+        runs = []
+        for run in range(args.runs):
+            torch.manual_seed(run)
+            net = cell(args.input_size, args.hidden_size, args.kernel_size)
+            init_weights(net, args.init_type, gain = args.init_gain)
+            runs.append(stats(net.gate_weights()))
+        results[name] = torch.tensor(runs).mean(dim = 0) # gate x (std, max sv, min sv)
+
+    ok = True
+    for g, gate in enumerate(["reset", "update", "out"]):
+        for s, stat in enumerate(["std", "max sv", "min sv"]):
+            legacy, fused = results["legacy"][g, s].item(), results["fused"][g, s].item()
+            diff = abs(fused - legacy) / max(abs(legacy), 1e-12)
+            ok = ok and diff <= args.tolerance
+            print(f"{gate:>6} {stat:>6}: legacy {legacy:.5f}, fused {fused:.5f}, relative difference {diff:.3f}")
+    print("OK" if ok else "MISMATCH")
+    sys.exit(0 if ok else 1)
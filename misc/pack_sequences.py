@@ -0,0 +1,19 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.packed_sequences import find_sequences, pack
+
+# packs an image-sequence dataset (videofolder/sky layout) into tar shards for --dataset_mode packed
+# usage: python misc/pack_sequences.py <dataroot>/train <dataroot_packed>/train
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack image sequences into sequential tar shards")
+    parser.add_argument("path", type=str, help="directory containing the sequence folders")
+    parser.add_argument("out", type=str, help="output directory for shards + index.json")
+    parser.add_argument("--shard_size", type=int, default=1024, help="shard size in MB")
+    args = parser.parse_args()
+
+    sequences = find_sequences(args.path)
+    print(f"found {len(sequences)} sequences in {args.path}")
+    pack(sequences, args.out, shard_size = args.shard_size * 1024 ** 2)
@@ -0,0 +1,37 @@
+import os
+import sys
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from options.train_options import TrainOptions
+from data import create_dataset
+from data.mask_store import mask_store_file, pack_masks, write_masks
+
+# computes the motion segmentation of every sample once and stores it bit packed for --precomputed_masks
+# usage: python misc/precompute_masks.py <same dataset args as train.py> [--phase test]
+# VideoDataset uses the first window of each clip instead of a random one (training with --precomputed_masks does too)
+if __name__ == "__main__":
+    opt = TrainOptions().parse()
+    opt.use_segmentation = True
+    opt.precomputed_masks = False
+    opt.segmentation_on_device = False
+    opt.no_augmentation = True
+    opt.batch_augmentation = False # masks are stored at --resolution
+    opt.windows_per_decode = 1 # one mask per sample
+
+    dataset = create_dataset(opt)
+    if hasattr(dataset, "fixed_start"):
+        dataset.fixed_start = True
+    loader = torch.utils.data.DataLoader(dataset, batch_size = opt.batch_size, shuffle = False, num_workers = int(opt.num_threads))
+
+    packed = []
+    for i, data in enumerate(loader):
+        packed.append(pack_masks(data['SEGMENTATION']))
+        if i % 100 == 0:
+            print(f"masks: {(i+1) * opt.batch_size}/{len(dataset)}")
+    packed = np.concatenate(packed, axis = 0)
+
+    file = mask_store_file(opt)
+    write_masks(file, packed)
+    print(f"wrote {packed.shape[0]} masks ({packed.nbytes / 1024 ** 2:.1f} MB) to {file}")
@@ -14,6 +14,7 @@ from dvdgan.Discriminators import TemporalDiscriminator as DvdTemporalDiscrimina
 from dvdgan.GResBlock import GResBlock, GResBlock3D
 from dvdgan.ConvGRU import ConvGRU
 from dvdgan.Normalization import SpectralNorm
+from data.motion_segmentation import motion_segmentation
 import stylegan2.model as sg2model
 from stylegan2.model import StyledConv
 
@@ -72,7 +73,10 @@ class DvdConditionalGenerator(nn.Module):
                 SpectralNorm(nn.Conv3d(1*ch, 1*ch, kernel_size=(3,3,3), padding=1)),
             )
 
-    def forward(self, x, noise = None):
+    def forward(self, x, noise = None, nframes = None):
+        # nframes: length of the generated clip incl. the input frame (default: nframes of the model)
+        nframes = self.nframes if nframes is None else nframes - 1
+        n_steps = math.ceil(nframes / self.step_frames)
         x = x * 2 - 1
         if len(x.shape) == 5: # B x T x 3 x W x H -> B x 3 x W x H (first frame)
             x = x[:,0,...]
@@ -96,26 +100,10 @@ class DvdConditionalGenerator(nn.Module):
             if isinstance(conv, ConvGRU):
                 if k > 0:
                     _, C, W, H = y.size()
-                    y = y.view(-1, self.n_steps, C, W, H).contiguous()
-
-                frame_list = []
-                for i in range(self.n_steps):
-                    if k == 0:
-                        if i == 0:
-                            frame_list.append(conv(y, [encoder_list[depth]]))  # T x [B x ch x ld x ld]
-                        else:
-                            frame_list.append(conv(y, frame_list[i - 1]))
-                    else:
-                        if i == 0:
-                            frame_list.append(conv(y[:,0,:,:,:].squeeze(1),[encoder_list[depth]]))  # T x [B x ch x ld x ld]
-                        else:
-                            frame_list.append(conv(y[:,i,:,:,:].squeeze(1), frame_list[i - 1]))
-                frame_hidden_list = []
-                for i in frame_list:
-                    frame_hidden_list.append(i[-1].unsqueeze(0))
-                y = torch.cat(frame_hidden_list, dim=0) # T x B x ch x ld x ld
-
-                y = y.permute(1, 0, 2, 3, 4).contiguous() # B x T x ch x ld x ld
+                    y = y.view(-1, n_steps, C, W, H)
+                else: # the first rnn gets the same input at every step
+                    y = y.unsqueeze(1).expand(-1, n_steps, -1, -1, -1)
+                y = conv.forward_sequence(y, [encoder_list[depth]]) # B x T x ch x ld x ld
                 B, T, C, W, H = y.size()
                 y = y.view(-1, C, W, H)
                 depth += 1
@@ -127,7 +115,7 @@ class DvdConditionalGenerator(nn.Module):
         BT, C, W, H = y.size()
 
         if self.step_frames > 1:
-            y = y.view(-1, self.n_steps, C, W, H) # B, T/S, C, W, H
+            y = y.view(-1, n_steps, C, W, H) # B, T/S, C, W, H
             y = y.permute(0, 2, 1, 3, 4) # B, C, T/S, W, H
             ysp = []
             for y_i in torch.split(y, split_size_or_sections = 1, dim = 2):
@@ -135,7 +123,7 @@ class DvdConditionalGenerator(nn.Module):
                 y_i = self.decoder(y_i)
                 ysp.append(y_i)
             y = torch.cat(ysp, dim = 2)# B, C, T, W, H
-            y = y.permute(0, 2, 1, 3, 4) [:,:self.nframes,...].contiguous() # B, T, C, W, H
+            y = y.permute(0, 2, 1, 3, 4) [:,:nframes,...].contiguous() # B, T, C, W, H
             _,_, C, W, H = y.size()
             y = y.view(-1, C, W, H)
 
@@ -158,7 +146,7 @@ class DvdConditionalGenerator(nn.Module):
             frame_0 = frame_0.unsqueeze(1)
 
         y = self.colorize(y)
-        y = y.view(-1, self.nframes,3, W, H) # B, T/S, C*S, W, H
+        y = y.view(-1, nframes,3, W, H) # B, T/S, C*S, W, H
         y = torch.tanh(y)
         y = torch.cat([frame_0, y],  dim = 1)
         y = (y+1) / 2.0 #[-1,1] -> [0,1] for vis
@@ -228,8 +216,10 @@ class DvdStyle2(nn.Module):
                 nn.Conv3d(1*ch, 1*ch, kernel_size=(3,3,3), padding=1),
             )
 
-    def forward(self, x, noise = None):
-        
+    def forward(self, x, noise = None, nframes = None):
+        # nframes: length of the generated clip incl. the input frame (default: nframes of the model)
+        nframes = self.nframes if nframes is None else nframes - 1
+        n_steps = math.ceil(nframes / self.step_frames)
         x = x * 2 - 1
         if len(x.shape) == 5: # B x T x 3 x W x H -> B x 3 x W x H (first frame)
             x = x[:,0,...]
@@ -241,22 +231,14 @@ class DvdStyle2(nn.Module):
         encoder_list.reverse()
 
         style = self.encoder2style(encoder_list[0])
-        style = style.unsqueeze(1).expand(-1, self.nframes, -1).contiguous().view(x.size(0)*self.nframes, -1) # BT x style
+        style = style.unsqueeze(1).expand(-1, nframes, -1).contiguous().view(x.size(0)*nframes, -1) # BT x style
         y = self.input(encoder_list[0]) #B x C x W x H
 
-        y = y.unsqueeze(1).expand(-1, self.nframes, -1, -1, -1) #B x T x C x W x H
+        y = y.unsqueeze(1).expand(-1, nframes, -1, -1, -1) #B x T x C x W x H
 
         for depth, (rnn, conv_list) in enumerate(zip(self.rnn, self.conv)): 
             if rnn:   
-                frame_list = [[encoder_list[depth]]*self.n_grulayers]
-                for i in range(self.nframes):
-                    #print(depth, i, y.shape, [x.shape for x in frame_list[-1]])
-                    frame_list.append(rnn(y[:,i,...].squeeze(1), frame_list[-1]))
-                frame_hidden_list = []
-                for i in frame_list[1:]: #collect hiddens of last rnn (ignore first frame =input)
-                    frame_hidden_list.append(i[-1].unsqueeze(0))
-                y = torch.cat(frame_hidden_list, dim=0) # T x B x ch x ld x ld
-                y = y.permute(1, 0, 2, 3, 4).contiguous() # B x T x ch x ld x ld
+                y = rnn.forward_sequence(y, [encoder_list[depth]]*self.n_grulayers) # B x T x ch x ld x ld
           
             *_,T, C, W, H = y.size()
 
@@ -270,13 +252,13 @@ class DvdStyle2(nn.Module):
                     y = conv(y, style) # BT, C, W, H
 
             _, C, W, H = y.size()
-            y = y.view(-1, self.nframes, C, W, H).contiguous()
+            y = y.view(-1, nframes, C, W, H).contiguous()
 
         *_, C, W, H = y.size()
         y = y.view(-1, C, W, H)
 
         if self.step_frames > 1:
-            y = y.view(-1, self.n_steps, C, W, H) # B, T/S, C, W, H
+            y = y.view(-1, n_steps, C, W, H) # B, T/S, C, W, H
             y = y.permute(0, 2, 1, 3, 4) # B, C, T/S, W, H
             ysp = []
             for y_i in torch.split(y, split_size_or_sections = 1, dim = 2):
@@ -284,14 +266,14 @@ class DvdStyle2(nn.Module):
                 y_i = self.decoder(y_i)
                 ysp.append(y_i)
             y = torch.cat(ysp, dim = 2)# B, C, T, W, H
-            y = y.permute(0, 2, 1, 3, 4) [:,:self.nframes,...].contiguous() # B, T, C, W, H
+            y = y.permute(0, 2, 1, 3, 4) [:,:nframes,...].contiguous() # B, T, C, W, H
             _,_, C, W, H = y.size()
             y = y.view(-1, C, W, H)
 
         frame_0 = x[:, :3, ...].unsqueeze(1)
 
         y = self.colorize(y, style)
-        y = y.view(-1, self.nframes,3, W, H) # B, T/S, C*S, W, H
+        y = y.view(-1, nframes,3, W, H) # B, T/S, C*S, W, H
         y = torch.tanh(y)
         y = torch.cat([frame_0, y],  dim = 1)
         y = (y+1) / 2.0 #[-1,1] -> [0,1] for vis
@@ -317,7 +299,9 @@ class DvdGanModel(BaseModel):
         BaseModel.initialize(self, opt)
         self.isTrain = opt.isTrain
         self.nframes = int(opt.max_clip_length * opt.fps / opt.skip_frames)
-        self.num_display_frames = min(opt.num_display_frames, self.nframes - 1) //2 *2
+        # --length_buckets: every batch has its own length, up to the longest bucket
+        self.max_frames = max([self.nframes] + opt.length_buckets)
+        self.num_display_frames = min([opt.num_display_frames, self.nframes - 1] + [b - 1 for b in opt.length_buckets]) //2 *2
         self.opt = opt
         self.iter = 1
         self.train_range = (1,self.nframes)
@@ -374,7 +358,7 @@ class DvdGanModel(BaseModel):
         if self.isTrain:
 
             self.ndsframes = opt.dvd_spatial_frames
-            assert self.nframes > self.ndsframes+1, "number of frames sampled for disc should be leq to number of total frames generated (length-1)"
+            assert min([self.nframes] + opt.length_buckets) > self.ndsframes+1, "number of frames sampled for disc should be leq to number of total frames generated (length-1)"
        
             #default chn = 128
             netDs = DvdSpatialDiscriminator(chn = opt.ch_ds, sigmoid = not self.wgan, input_nc = (3 + input_nc) if self.conditional else 3 )
@@ -416,31 +400,39 @@ class DvdGanModel(BaseModel):
         self.loss_Dt_GP = 0
 
     def set_input(self, input, noise = None):
-        self.target_video = input['VIDEO'].to(self.device).permute(0,1,4,2,3).float() / 255.0 #normalize to [0,1] for vis and stuff
+        self.target_video = input['VIDEO'].to(self.device, non_blocking=True).permute(0,1,4,2,3).float() / 255.0 #uint8 -> [0,1] on device, for vis and stuff
         self.input = self.target_video[:,0,...]#first frame
         self.noise = noise.to(self.device) if noise else None
+        if self.opt.use_segmentation or self.opt.masked_update: 
+            if self.opt.segmentation_on_device: 
+                seg = motion_segmentation(self.target_video.permute(0,1,3,4,2), eps = self.opt.motion_seg_eps / 255.0).permute(0,3,1,2)
+            else: 
+                seg = input["SEGMENTATION"].to(self.device, non_blocking=True)
         if self.opt.use_segmentation: 
-            self.input = torch.cat([self.input, input["SEGMENTATION"].to(self.device)], dim = 1)
+            self.input = torch.cat([self.input, seg], dim = 1)
         if self.opt.masked_update: 
-            self.mask = input["SEGMENTATION"].to(self.device).expand(-1, 3, -1, -1)
+            self.mask = seg.expand(-1, 3, -1, -1)
 
         _, T, *_ = self.target_video.shape
-        self.target_video = self.target_video[:, :min(T,self.nframes),...]
+        self.target_video = self.target_video[:, :min(T,self.max_frames),...]
 
     def forward(self, frame_length = -1, train = True):
         nFrames = frame_length if frame_length>0 else self.nframes
         if hasattr(self.netG, "nFrames"):
             self.netG.nFrames = nFrames
 
-        self.predicted_video = self.netG(self.input, noise = self.noise) 
+        # bucketed batches differ in length, generate as many frames as the batch holds
+        nframes = self.target_video.size(1) if self.opt.length_buckets else None
+        self.predicted_video = self.netG(self.input, noise = self.noise, nframes = nframes) 
         if self.opt.masked_update: 
             B,T,C,W,H = self.predicted_video.size()
             self.predicted_video = torch.where(self.mask.byte().unsqueeze(1).expand(B,T,C,W,H),self.predicted_video, self.target_video[:,:1,...].expand(B,T,C,W,H))
 
-        if self.target_video.size(1) >= self.nframes: 
-            self.prediction_target_video = torch.cat([self.predicted_video[:, :self.nframes,...].detach().cpu(), self.target_video.detach().cpu()], dim = 4)
+        T = self.predicted_video.size(1)
+        if self.target_video.size(1) >= T: 
+            self.prediction_target_video = torch.cat([self.predicted_video.detach().cpu(), self.target_video[:, :T,...].detach().cpu()], dim = 4)
         else: 
-            self.prediction_target_video = self.predicted_video[:, :self.nframes,...].detach().cpu()
+            self.prediction_target_video = self.predicted_video.detach().cpu()
 
         for i in range(self.num_display_frames//2):
             setattr(self,f"frame_{i}", self.predicted_video[:,i,...].detach().cpu() )
@@ -584,12 +576,11 @@ class DvdGanModel(BaseModel):
 
     def compute_losses(self, epoch, verbose = False):
         verbose = verbose or self.opt.verbose
-        Te = self.nframes
         B, TT,*_ = self.target_video.shape
 
-        self.forward(frame_length=Te)
+        self.forward()
         _, T,*_ = self.predicted_video.shape
-        T = min(T,TT,Te) # just making sure to cut target if we didnt predict all the frames and to cut prediction, if we predicted more than target (i.e. we already messed up somewhere)
+        T = min(T,TT) # just making sure to cut target if we didnt predict all the frames and to cut prediction, if we predicted more than target (i.e. we already messed up somewhere)
         if verbose: 
             print(f"Pred Vid:   min: {self.predicted_video[:,1:,...].min().item()}; max:  {self.predicted_video[:,1:,...].max().item()}; avg: {self.predicted_video[:,1:,...].mean().item()}")
             print(f"Target Vid: min: {self.target_video.min().item()}; max:  {self.target_video.max().item()}; avg: {self.target_video.mean().item()}")
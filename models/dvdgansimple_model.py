@@ -365,7 +365,7 @@ class DvdGanSimpleModel(BaseModel):
 
 
     def set_input(self, input):
-        self.target_video = input['VIDEO'].to(self.device).permute(0,1,4,2,3).float() / 255.0 #normalize to [0,1] for vis and stuff 
+        self.target_video = input['VIDEO'].to(self.device, non_blocking=True).permute(0,1,4,2,3).float() / 255.0 #uint8 -> [0,1] on device, for vis and stuff 
         self.input = self.target_video[:,0,...]#first frame
         _, T, *_ = self.target_video.shape
         self.target_video = self.target_video[:, :min(T,self.nframes),...]
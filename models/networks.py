@@ -45,19 +45,26 @@ def init_weights(net, init_type='normal', gain=0.02):
     if init_type == "none": 
         return
         
+    def init_weight(w):
+        if init_type == 'normal':
+            init.normal_(w, 0.0, gain)
+        elif init_type == 'xavier':
+            init.xavier_normal_(w, gain=gain)
+        elif init_type == 'kaiming':
+            init.kaiming_normal_(w, a=0, mode='fan_in')
+        elif init_type == 'orthogonal':
+            init.orthogonal_(w, gain=gain)
+        else:
+            raise NotImplementedError('initialization method [%s] is not implemented' % init_type)
+        return w
+
     def init_func(m):
         classname = m.__class__.__name__
-        if hasattr(m, 'weight') and (classname.find('Conv') != -1 or classname.find('Linear') != -1):
-            if init_type == 'normal':
-                init.normal_(m.weight.data, 0.0, gain)
-            elif init_type == 'xavier':
-                init.xavier_normal_(m.weight.data, gain=gain)
-            elif init_type == 'kaiming':
-                init.kaiming_normal_(m.weight.data, a=0, mode='fan_in')
-            elif init_type == 'orthogonal':
-                init.orthogonal_(m.weight.data, gain=gain)
-            else:
-                raise NotImplementedError('initialization method [%s] is not implemented' % init_type)
+        if hasattr(m, 'init_gates'):
+            # fused gate convolutions (ConvGRUCell), applied after its convs: every gate is initialized in its own shape
+            m.init_gates(init_weight)
+        elif hasattr(m, 'weight') and (classname.find('Conv') != -1 or classname.find('Linear') != -1):
+            init_weight(m.weight.data)
             if hasattr(m, 'bias') and m.bias is not None:
                 init.constant_(m.bias.data, 0.0)
         # elif classname.find('BatchNorm2d') != -1:
@@ -29,6 +29,10 @@ class BaseOptions():
         parser.add_argument('--epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
         parser.add_argument('--load_iter', type=int, default='0', help='which iteration to load? if load_iter > 0, the code will load models by iter_[load_iter]; otherwise, the code will load models by [epoch]')
         parser.add_argument('--num_threads', default=6, type=int, help='# threads for loading data')
+        parser.add_argument('--world_size', type=int, default=int(os.environ.get("WORLD_SIZE", 1)), help='number of training processes, each one only loads its own shard of the data')
+        parser.add_argument('--rank', type=int, default=int(os.environ.get("RANK", 0)), help='rank of this process in [0, world_size)')
+        parser.add_argument('--prefetch', action='store_true', help='keep loader workers alive across epochs and stage the next batch on the device (background thread on cpu) while the current one is processed')
+        parser.add_argument('--prefetch_factor', type=int, default=2, help='batches prepared in advance per worker / in the cpu prefetch queue')
         parser.add_argument('--checkpoints_dir', type=str, default='../checkpoints', help='models are saved here')
         parser.add_argument('--norm', type=str, default='instance', help='instance normalization or batch normalization')
         parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')
@@ -51,6 +55,10 @@ class BaseOptions():
 
         parser.add_argument('--sanity_check', action='store_true', help='perform sanity check before running model')
         parser.add_argument('--reparse_data', action='store_true', help='reparse data set when applicable (e.g for new clip length)')
+        parser.add_argument('--probe_clips', action='store_true', help='decode every clip once (cached next to the data) and drop clips that are too short or broken before training')
+        parser.add_argument('--length_buckets', type=str, default="", help='comma separated clip lengths in frames (after skip_frames), eg. 16,32,48: training batches only hold clips of one length (video dataset, dvdgan model)')
+        parser.add_argument('--bucket_frame_budget', type=int, default=0, help='frames per bucketed batch, the batch size of a bucket is budget // length (0: batch_size * nframes)')
+        parser.add_argument('--probe_workers', type=int, default=8, help='number of processes for --probe_clips')
         parser.add_argument('--resolution', type=int, default=64, help='spatial resolution')
         parser.add_argument('--unroll_frames', type=int, default=1, help='compute N frames per GRU unroll')
 
@@ -59,8 +67,13 @@ class BaseOptions():
         parser.add_argument('--use_segmentation', action='store_true', help='Use DeepLab V3 (cocostuff) precomputed semantic segmentation as additional input')
         parser.add_argument('--num_segmentation_classes',  type=int, default=1, help='number of classes if sem seg is used')
         parser.add_argument('--motion_seg_eps',  type=float, default=15, help='theshold for detecing motion via diff frames (images are in (0,256)')
+        parser.add_argument('--segmentation_on_device', action='store_true', help='compute motion segmentation per batch in set_input on the training device instead of in the dataset')
+        parser.add_argument('--precomputed_masks', action='store_true', help='read motion segmentation masks from the bit packed store written by misc/precompute_masks.py instead of computing them per sample')
 
         parser.add_argument('--no_augmentation', action='store_true', help='disable augmentation')
+        parser.add_argument('--batch_augmentation', action='store_true', help='datasets only decode, resize + augmentation run on the collated batch on the training device (clips in a batch must share their source resolution)')
+        parser.add_argument('--aug_crop_scale', type=float, default=1.0, help='batch augmentation: random crops cover [aug_crop_scale, 1] of each side (1: no cropping)')
+        parser.add_argument('--aug_jitter', type=float, default=0.0, help='batch augmentation: max. relative brightness/contrast/saturation change')
         parser.add_argument('--no_wgan', action='store_true', help='use classic gan')
         parser.add_argument('--no_bn', action='store_true', help='disable batchnorm')
         parser.add_argument('--no_noise', action='store_true', help='disable noise input')
@@ -152,5 +165,7 @@ class BaseOptions():
             if len(opt.gpu_ids) > 0:
                 torch.cuda.set_device(opt.gpu_ids[0])
 
+        opt.length_buckets = [int(b) for b in opt.length_buckets.split(',')] if opt.length_buckets else []
+
         self.opt = opt
         return self.opt
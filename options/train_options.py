@@ -43,6 +43,8 @@ class TrainOptions(BaseOptions):
         parser.add_argument('--dvd_temporal_downsample', type=int, default=2, help='down sample factor for temportal discriminator')
         parser.add_argument('--pretrain_epochs', type=int, default=0, help='train discriminator for n epochs before training generator')
         parser.add_argument('--max_val_dataset_size', type=int, default=1000, help='cap validation set size')
+        parser.add_argument('--validation_cache', action='store_true', help='decode the validation set once (fixed windows) and serve later validation passes from memory')
+        parser.add_argument('--validation_cache_mb', type=int, default=4096, help='validation caches larger than this are memory mapped from disk')
 
         parser.add_argument('--fast_sample_len', type=int, default=-1, help='compute grads for a small time window')
 
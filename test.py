@@ -10,6 +10,7 @@ from PIL import Image
 import time
 import re
 from torchvision.utils import save_image
+from dvdgan.Normalization import freeze_spectral_norm
 
 import torchvision
 
@@ -46,6 +47,10 @@ if __name__ == '__main__':
     model = create_model(opt)
     print('>>> setup model <<<')
     model.setup(opt)
+    # spectral norms: weights normalized once instead of a power iteration in every forward
+    for name in model.model_names:
+        if isinstance(name, str) and isinstance(getattr(model, name), torch.nn.Module):
+            freeze_spectral_norm(getattr(model, name))
     # create a website    
     print('>>> create a website <<<')
     web_dir = os.path.join(opt.results_dir, opt.name, '%s_%s' % (opt.phase, opt.epoch))
@@ -2,6 +2,7 @@ import time
 import os
 from options.train_options import TrainOptions
 from data import CreateDataLoader, SplitDataLoader
+from data.validation_cache import ValidationCache
 from models import create_model
 from util.visualizer import Visualizer
 import torch
@@ -10,6 +11,10 @@ from PIL import Image
 from sanity_check import sanity_check
 import copy
 
+# whether the steps [step, step + n) pass a multiple of freq (batches vary in size with --length_buckets)
+def crosses(step, n, freq):
+    return (step + n - 1) // freq != (step - 1) // freq
+
 if __name__ == '__main__':
     opt = TrainOptions().parse()
 
@@ -41,6 +46,8 @@ if __name__ == '__main__':
         else:
             validation_loader = CreateDataLoader(opt_val)
         validation_set = validation_loader.load_data()
+        if opt.validation_cache: 
+            validation_set = ValidationCache(validation_loader, opt.validation_cache_mb * 1024 ** 2, os.path.join(opt.checkpoints_dir, opt.name, "validation_cache"))
         validation_size = len(validation_loader)
 
     dataset = data_loader.load_data()
@@ -98,7 +105,8 @@ if __name__ == '__main__':
             if os.path.exists(abort_file): 
                 exit("Abort using file: " + abort_file)
             iter_start_time = time.time()
-            if total_steps % opt.print_freq == 0:
+            n_samples = data['VIDEO'].size(0) # varies with --length_buckets
+            if crosses(total_steps, n_samples, opt.print_freq):
                 t_data = iter_start_time - iter_data_time
             visualizer.reset()
   
@@ -112,18 +120,18 @@ if __name__ == '__main__':
             ################## end training code ##################
 
             verbose = False or opt.verbose
-            if total_steps % opt.display_freq == 0:
-                save_result = total_steps % opt.update_html_freq == 0
+            if crosses(total_steps, n_samples, opt.display_freq):
+                save_result = crosses(total_steps, n_samples, opt.update_html_freq)
                 visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
-            if total_steps % (opt.print_freq) == 0:
+            if crosses(total_steps, n_samples, opt.print_freq):
                 print(opt.name)
                 losses = model.get_current_losses()
-                t = (time.time() - iter_start_time) / opt.batch_size
+                t = (time.time() - iter_start_time) / n_samples
                 visualizer.print_current_losses(epoch, epoch_iter, losses, t, t_data)
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, opt, losses)
-            total_steps += opt.batch_size
-            epoch_iter += opt.batch_size
+            total_steps += n_samples
+            epoch_iter += n_samples
             
             iter_data_time = time.time()
         if epoch % opt.save_epoch_freq == 0:
@@ -131,6 +139,6 @@ if __name__ == '__main__':
             model.save_networks('latest')
             model.save_networks(epoch)
 
-        print('End of epoch %d / %d \t Time Taken: %d sec' %
-              (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
+        print('End of epoch %d / %d \t Time Taken: %d sec (waiting for data: %d sec)' %
+              (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time, dataset.data_time))
         model.update_learning_rate()
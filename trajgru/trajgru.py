@@ -7,25 +7,38 @@ https://github.com/Hzzone/Precipitation-Nowcasting/blob/master/nowcasting/models
 import torch
 from torch import nn
 import torch.nn.functional as F
+from dvdgan.HiddenState import zero_state
+
+_grids = {}
+
+# pixel grid in grid_sample coordinates ([-1,1], align_corners=True), 1 x H x W x 2 (x, y), cached per size and device
+def base_grid(H, W, device, dtype=torch.float):
+    key = (H, W, device, dtype)
+    if key not in _grids:
+        with torch.no_grad():
+            yy, xx = torch.meshgrid(torch.arange(H, device=device, dtype=dtype), torch.arange(W, device=device, dtype=dtype))
+            grid = torch.stack([2.0 * xx / max(W - 1, 1) - 1.0, 2.0 * yy / max(H - 1, 1) - 1.0], dim=-1).unsqueeze(0)
+            scale = torch.tensor([2.0 / max(W - 1, 1), 2.0 / max(H - 1, 1)], device=device, dtype=dtype)
+        _grids[key] = (grid, scale)
+    return _grids[key]
 
 # input: B, C, H, W
-# flow: [B, 2, H, W]
-def wrap(input, flow):
+# flows: [B, 2*L, H, W] (L flows of x, y pixel offsets)
+# output: B, L*C, H, W (input warped by every flow), one grid_sample over B*L
+def wrap_all(input, flows):
     B, C, H, W = input.size()
-    # mesh grid
-    xx = torch.arange(0, W).view(1, -1).repeat(H, 1).to(input.device)
-    yy = torch.arange(0, H).view(-1, 1).repeat(1, W).to(input.device)
-    xx = xx.view(1, 1, H, W).repeat(B, 1, 1, 1)
-    yy = yy.view(1, 1, H, W).repeat(B, 1, 1, 1)
-    grid = torch.cat((xx, yy), 1).float()
-    vgrid = grid + flow
-
-    # scale grid to [-1,1]
-    vgrid[:, 0, :, :] = 2.0 * vgrid[:, 0, :, :].clone() / max(W - 1, 1) - 1.0
-    vgrid[:, 1, :, :] = 2.0 * vgrid[:, 1, :, :].clone() / max(H - 1, 1) - 1.0
-    vgrid = vgrid.permute(0, 2, 3, 1)
+    L = flows.size(1) // 2
+    grid, scale = base_grid(H, W, input.device, input.dtype)
+    flows = flows.view(B, L, 2, H, W).permute(0, 1, 3, 4, 2).reshape(B * L, H, W, 2)
+    vgrid = grid + flows * scale
+    input = input.unsqueeze(1).expand(B, L, C, H, W).reshape(B * L, C, H, W)
     output = torch.nn.functional.grid_sample(input, vgrid, align_corners=True)
-    return output
+    return output.view(B, L * C, H, W)
+
+# input: B, C, H, W
+# flow: [B, 2, H, W]
+def wrap(input, flow):
+    return wrap_all(input, flow)
 
 class BaseConvRNN(nn.Module):
     def __init__(self, num_filter,
@@ -121,8 +134,7 @@ class TrajGRU(BaseConvRNN):
         f_conv1 = i2f_conv1 + h2f_conv1 if i2f_conv1 is not None else h2f_conv1
         f_conv1 = self._act_type(f_conv1)
 
-        flows = self.flows_conv(f_conv1)
-        flows = torch.split(flows, 2, dim=1)
+        flows = self.flows_conv(f_conv1) # B x 2L x H x W
         return flows
 
     # inputs 和 states 不同时为空
@@ -137,8 +149,7 @@ class TrajGRU(BaseConvRNN):
         state_width = (W + 2 * self._i2h_pad[1] - i2h_dilate_ksize_w) \
                              // self._i2h_stride[1] + 1
         if states is None:
-            states = torch.zeros((inputs.size(1), self._num_filter, state_height,
-                                  state_width), dtype=torch.float).to(inputs.device)
+            states = zero_state((B, self._num_filter, state_height, state_width), inputs)
         if inputs is not None:
             i2h = self.i2h(torch.reshape(inputs, (-1, C, H, W)))
             i2h = torch.reshape(i2h, (S, B, i2h.size(1), i2h.size(2), i2h.size(3)))
@@ -154,11 +165,7 @@ class TrajGRU(BaseConvRNN):
             flows = self._flow_generator(inputs[i, ...], prev_h)
         else:
             flows = self._flow_generator(None, prev_h)
-        wrapped_data = []
-        for j in range(len(flows)):
-            flow = flows[j]
-            wrapped_data.append(wrap(prev_h, -flow))
-        wrapped_data = torch.cat(wrapped_data, dim=1)
+        wrapped_data = wrap_all(prev_h, -flows)
         h2h = self.ret(wrapped_data)
         h2h_slice = torch.split(h2h, self._num_filter, dim=1)
         if i2h_slice is not None: